@@ -36,17 +36,88 @@ id_cana      = "OBJECTID"
 filtre       = "Profondeur like '%BRANCHEMENT%' or Profondeur like 'VANNE%'    \
 or Profondeur like '%VENTOUSE%' or Profondeur like '%PURGE%'or Profondeur like \
 '%VIDANGE%' or Profondeur like '%PI%' or Profondeur like '%BI%'" 
+mode_pipeline = True
+branches_paralleles = False
+distance_max  = None
+k_voisins     = 4
+methode_affectation = "glouton"
+mode_segments    = False
+tolerance_sommet = 0.5
+seuil_deplacement = 2.0
+seuil_longueur    = 0.1
+fichier_cache = ""
+processus     = 1
+halo          = None
+fichier_rapport = ""
+mesure_memoire  = False
+dossier_index    = ""
+taille_max_index = 500
+dossier_scripts = ""
 
 #AIDE : 
 
 #     - canalisation doit contenir le nom exact de la couche de canalisations
 #     - topo doit contenir le nom exact de la couche de points topographiques
 #       Il doit obligaoirement avoir un champ nommé exactement 'X'(pas X_RELEVE)
+#       Avec mode_pipeline = True, on peut aussi donner le chemin complet de 
+#       l'export CSV LEICA (X, Y, Z, Profondeur) : il est lu par blocs et 
+#       filtré pendant la lecture, sans charger de couche
 #     - id_cana doit contenir le nom de l'identifiant unique de la canalisation
 #     - filtre contient le formule qui va être utilisée pour ne prélever que les
 #       points topographiques qui vont se trouver le long de la canalisation. 
 #       exemple : 
 #       filtre = " OBJET IN ('BRT', 'PURGE', 'VANNE', 'VENTOUSE', 'PI', 'BI') "
+#     - mode_pipeline = True pour le traitement en une seule passe en mémoire
+#       (sans couches temporaires intermédiaires), False pour l'enchaînement
+#       historique des algorithmes de traitement
+#     - branches_paralleles = True pour extraire les sommets des canalisations
+#       et filtrer la topo en même temps dans l'enchaînement historique, False
+#       pour le faire l'un après l'autre. Le gain n'est pas mesuré et la topo
+#       est alors lue sur une copie : à comparer sur ses données avant de 
+#       l'activer (banc d'essai)
+#     - distance_max est la distance maximale (unités de la couche) à laquelle
+#       un point topo peut être accroché à un sommet. None = pas de limite
+#     - k_voisins est le nombre de sommets candidats étudiés pour chaque point
+#     - methode_affectation règle les conflits (plusieurs points visant le même
+#       sommet) sur l'ensemble du réseau : "glouton" (plus courtes distances 
+#       d'abord), "hongrois" (optimal par groupe de points en conflit) ou None
+#       (le premier point garde le sommet, les autres sont à recaler à la main)
+#     - mode_segments = True (mode_pipeline = True) pour projeter chaque point
+#       topo sur le segment de canalisation le plus proche (à moins de 
+#       distance_max) au lieu de l'accrocher à un sommet : un sommet est 
+#       inséré au point projeté, avec le z du point topo. Un point projeté
+#       à moins de tolerance_sommet (unités de la couche) d'un sommet 
+#       existant le remplace comme d'habitude : la garder de l'ordre de 
+#       l'écart d'un relevé, sans quoi chaque point relevé sur un sommet en
+#       insère un nouveau juste à côté. Demande shapely 2 ; se passe de 
+#       fichier_cache, de processus et de methode_affectation
+#     - seuil_deplacement et seuil_longueur (mode_pipeline = True) règlent le
+#       contrôle du recalage : une canalisation dont un sommet a bougé de plus
+#       de seuil_deplacement (unités de la couche), ou dont la longueur a 
+#       changé de plus de seuil_longueur (part de la longueur d'origine, 
+#       0.1 = 10 %), est signalée dans la couche CONTROLE_RECALAGE (un point
+#       sur son sommet le plus déplacé). None = seuil non contrôlé
+#     - fichier_cache est le chemin d'un fichier .npz où garder le résultat
+#       d'un passage à l'autre (mode_pipeline = True) : seuls les points topo
+#       et les canalisations voisins d'une canalisation ou d'un point modifié,
+#       ajouté ou supprimé sont recalculés. Laisser vide pour tout recalculer
+#     - processus est le nombre de processus pour l'accrochage et 
+#       l'affectation (mode_pipeline = True) : 1 = calcul dans Qgis, None = un
+#       par coeur. Le réseau est découpé en tuiles élargies de halo (unités de
+#       la couche, None = distance_max, qui doit alors être renseignée)
+#     - fichier_rapport est le chemin d'un fichier .json ou .csv où écrire la
+#       durée et les effectifs de chaque étape et les comptages de contrôle.
+#       Laisser vide pour ne pas l'écrire. mesure_memoire = True y ajoute le
+#       pic mémoire de chaque étape (traitement plus lent : diagnostic)
+#     - dossier_index est un dossier où garder d'un lancement à l'autre 
+#       (mode_pipeline = True) les sommets des canalisations avec leur index 
+#       KD-tree, et les points retenus de l'export CSV LEICA : ils sont relus 
+#       tant que le fichier source, son système de coordonnées (et le filtre
+#       pour la topo) n'ont pas changé. Laisser vide pour tout relire à chaque
+#       fois. Les entrées les moins récemment utilisées sont effacées
+#       au-delà de taille_max_index (Mo)
+#     - dossier_scripts est le dossier contenant ce script et ses modules
+#       (PY3_MOTEUR_RECALAGE_V1.py...). Laisser vide s'il est trouvé tout seul
 
 #       Tous les noms doivent être entre guillemets
 
@@ -56,9 +127,29 @@ or Profondeur like '%VENTOUSE%' or Profondeur like '%PURGE%'or Profondeur like \
 ####                             PARTIE FONCTIONS                           ####
 
 #Imports de modules
+import os
+import sys
+import numpy      as np
 import processing
-from   qgis.core  import QgsProject
+from   qgis.core  import (QgsProject, QgsExpression, QgsExpressionContext,
+                          QgsFeature, QgsFeatureRequest, QgsField, QgsFields,
+                          QgsGeometry, QgsLineString,
+                          QgsMemoryProviderUtils, QgsPoint, QgsProcessing,
+                          QgsProcessingUtils, QgsWkbTypes, NULL)
 import PyQt5
+from   qgis.PyQt.QtCore    import QVariant
+from   qgis.PyQt.QtWidgets import QMessageBox
+
+#Accès aux modules rangés avec ce script
+if not dossier_scripts and '__file__' in globals() : 
+    dossier_scripts = os.path.dirname(os.path.abspath(__file__))
+if dossier_scripts and dossier_scripts not in sys.path : 
+    sys.path.append(dossier_scripts)
+import PY3_INDEX_SPATIAL_V1   as index_spatial
+import PY3_INCREMENTAL_V1     as incremental
+import PY3_INSTRUMENTATION_V1 as instrumentation
+import PY3_MOTEUR_RECALAGE_V1 as moteur
+import PY3_ORDONNANCEUR_V1    as ordonnanceur
 
 def extraire_sommets(canalisation) : 
     '''Extrait les sommets d'une couche selon ses paramètres en entrée
@@ -74,68 +165,173 @@ def extraire_sommets(canalisation) :
     
     return points['OUTPUT']
 
-def creation_champ(couche, nom_champ) : 
+def creation_champ(couche, nom_champ, type_champ=QVariant.String) : 
     '''Crée la colonne de nom nom_champ dans la couche en entrée'''
     
-    couche.dataProvider().addAttributes([QgsField(nom_champ, QVariant.String)])
+    couche.dataProvider().addAttributes([QgsField(nom_champ, type_champ)])
     couche.updateFields()                                #Rafraîchit
 
+def ecrire_valeurs(couche, nom_champ, valeurs) : 
+    '''Écrit d'un seul coup les valeurs de la colonne nom_champ, directement 
+    dans le fournisseur de données (ni tampon d'édition, ni historique)
+    valeurs : fonction qui reçoit le rang de l'entité (0, 1, ...) et rend 
+    la valeur à écrire'''
+    field_index = couche.dataProvider().fieldNameIndex(nom_champ) #Champ
+    requete     = QgsFeatureRequest().setNoAttributes()                        \
+                                     .setFlags(QgsFeatureRequest.NoGeometry)
+    changements = {feature.id() : {field_index : valeurs(rang)} 
+                   for rang, feature in enumerate(couche.getFeatures(requete))}
+    couche.dataProvider().changeAttributeValues(changements) #Écriture groupée
+
 def identifiant_unique(couche, champ_id) : 
     '''Modifie la couche en entrée un identifiant unique dans la colonne
-    champ_id'''
-
-    field_index = couche.dataProvider().fieldNameIndex(champ_id) #Choix du champ
-    couche.startEditing()                                        #Mode édition
-    count = 1                                            #Première valeur d'id
-    for feature in couche.getFeatures():                 #Remplissage de la col
-        _     = couche.changeAttributeValue(feature.id(),field_index,count)
-        count +=1
+    champ_id (1, 2, 3...), en une seule écriture groupée'''
+    ecrire_valeurs(couche, champ_id, lambda rang : rang + 1)
 
 def maj_champ(couche, nom_champ, valeur) : 
-    '''Met à jour la colonne nom_champ dans couche avec la valeur en entrée'''
-    field_index = couche.dataProvider().fieldNameIndex(nom_champ)
-    couche.startEditing()                                 #Mode édition
-    for feature in couche.getFeatures():                  #Remplissage de la col
-        _     = couche.changeAttributeValue(feature.id(),field_index,valeur)
-
-
-def jointure_proche_sommet(points1, points2) : 
-    '''Joint la couche des regards avec une couche de points en entrée
-    Sortie : Couche temporaire issue de la jointure au plus proche voisin'''
-    jointure = processing.run('native:joinbynearest', 
-                              {'INPUT'       : points1,
-                               'INPUT_2'     : points2, 
-                               'PREDICATE'   : '2', 
-                               'NEIGHBORS': 1,
-                               'PREFIX'      : '',
-                               'OUTPUT'      : QgsProcessing.TEMPORARY_OUTPUT 
-                               })
-    return jointure['OUTPUT']
+    '''Met à jour la colonne nom_champ dans couche avec la valeur en entrée, 
+    en une seule écriture groupée'''
+    ecrire_valeurs(couche, nom_champ, lambda rang : valeur)
+
+
+def coordonnees(entites) : 
+    '''Tableau (n, 2) des coordonnées X Y du premier sommet de chaque entité'''
+    xy = [(p.x(), p.y()) for p in (f.geometry().vertexAt(0) for f in entites)]
+    return np.array(xy, dtype=np.float64).reshape(-1, 2)
+
+def choisir_sommets(distances, indices, methode=None) : 
+    '''Choisit un sommet par point parmi ses candidats : le plus proche si 
+    methode vaut None, sinon l'affectation globale sans conflit du moteur
+    Sortie : sommet choisi (-1 = aucun) et distance de chaque point'''
+    if methode is None : 
+        return indices[:, 0], distances[:, 0]
+    choix   = moteur.affecter_points(distances, indices, methode)
+    colonne = np.argmax(indices == choix[:, None], axis=1)
+    return choix, distances[np.arange(len(choix)), colonne]
+
+def jointure_proche_sommet(points1, points2, distance_max=None, k=1, 
+                           methode=None) : 
+    '''Joint chaque point de points1 au sommet de points2 le plus proche, par 
+    une seule requête groupée sur un index KD-tree des sommets. Avec une 
+    methode d'affectation, chaque point prend le meilleur sommet libre parmi 
+    ses k plus proches. Les points au-delà de distance_max ou sans sommet 
+    libre gardent des attributs de jointure vides
+    Sortie : Couche temporaire issue de la jointure au plus proche voisin, la
+    distance d'accrochage est dans le champ DISTANCE_ACCROCHAGE (le champ 
+    'distance' des sommets extraits est la distance le long de la ligne)'''
+    entites1 = [f for f in points1.getFeatures() if f.hasGeometry()]
+    entites2 = [f for f in points2.getFeatures() if f.hasGeometry()]
+    
+    #Index des sommets et requête groupée
+    index    = moteur.indexer_sommets(coordonnees(entites2))
+    distances, indices = moteur.accrocher_points(index, coordonnees(entites1),
+                                                 k, distance_max)
+    choix, distances   = choisir_sommets(distances, indices, methode)
+    
+    #Couche de sortie : champs des points, des sommets et distance
+    champs   = QgsProcessingUtils.combineFields(points1.fields(), 
+                                                points2.fields())
+    if not champs.append(QgsField('DISTANCE_ACCROCHAGE', QVariant.Double)) : 
+        raise ValueError("Le champ DISTANCE_ACCROCHAGE existe déjà dans les "
+                         "couches jointes")
+    jointure = QgsMemoryProviderUtils.createMemoryLayer(
+        'Couche jointe', champs, points1.wkbType(), points1.crs())
+    
+    vide     = [None] * points2.fields().count()
+    entites  = []
+    for feature, distance, indice in zip(entites1, distances, choix) : 
+        entite = QgsFeature(champs)
+        entite.setGeometry(feature.geometry())
+        if indice >= 0 :                                #Sommet trouvé
+            entite.setAttributes(feature.attributes() 
+                                 + entites2[indice].attributes() 
+                                 + [float(distance)])
+        else : 
+            entite.setAttributes(feature.attributes() + vide + [None])
+        entites.append(entite)
+    jointure.dataProvider().addFeatures(entites)
+    jointure.updateExtents()
+    
+    return jointure
 
 
 def separer_doublons(couche, champ) : 
     '''Divise la couche selon ses doublons dans un champs de la table : rend une
-    couche sans doublons et celle des doublons'''
-    jointure = processing.run('native:removeduplicatesbyattribute', 
-                              {'INPUT'      : couche,
-                               'FIELDS'     : champ, 
-                               'OUTPUT'     : QgsProcessing.TEMPORARY_OUTPUT, 
-                               'DUPLICATES' : QgsProcessing.TEMPORARY_OUTPUT 
-                               })
+    couche sans doublons et celle des doublons. Les entités dont le champ est 
+    vide (point sans sommet attribué) vont avec les doublons'''
+    index    = couche.fields().indexOf(champ)
+    valides  = []
+    doublons = []
+    vus      = set()
+    for feature in couche.getFeatures() : 
+        valeur = feature.attribute(index)
+        if valeur is None or valeur == NULL or valeur in vus : 
+            doublons.append(feature)
+        else : 
+            vus.add(valeur)
+            valides.append(feature)
+    
+    couches = []
+    for nom, entites in (('Sans doublons', valides), ('Doublons', doublons)) : 
+        sortie = QgsMemoryProviderUtils.createMemoryLayer(
+            nom, couche.fields(), couche.wkbType(), couche.crs())
+        sortie.dataProvider().addFeatures(entites)
+        sortie.updateExtents()
+        couches.append(sortie)
     
-    return jointure['OUTPUT'], jointure['DUPLICATES']
+    return couches[0], couches[1]
 
 
-def points_vers_lignes(points, id_cana) : 
-    '''Transforme une couche de points en couche de lignes'''
-    ligne = processing.run('qgis:pointstopath', 
-                           {'INPUT'       : points, 
-                            'ORDER_FIELD' : 'vertex_index', 
-                            'GROUP_FIELD' : id_cana, 
-                            'OUTPUT'      : QgsProcessing.TEMPORARY_OUTPUT 
-                            })
-    
-    return ligne['OUTPUT']
+def points_vers_lignes(points, id_cana) :
+    '''Transforme une couche de points en couche de lignes (à la place de
+    qgis:pointstopath) : les points sont rangés dans un magasin en colonnes,
+    triés par id_cana puis vertex_index en un seul tri groupé, et chaque ligne
+    est créée d'un bloc
+    Sortie : couche temporaire de lignes avec le seul champ id_cana'''
+    index_id   = points.fields().lookupField(id_cana)
+    index_rang = points.fields().lookupField('vertex_index')
+    requete    = QgsFeatureRequest().setSubsetOfAttributes([index_id,
+                                                            index_rang])
+    groupes    = {}                     #Numéro de ligne de chaque id_cana
+    ids        = []
+    rangs      = []
+    xyz        = []
+    for feature in points.getFeatures(requete) :
+        if not feature.hasGeometry() :
+            continue
+        point = feature.geometry().vertexAt(0)
+        rang  = feature.attribute(index_rang)
+        ids.append(groupes.setdefault(feature.attribute(index_id),
+                                      len(groupes)))
+        rangs.append(0 if rang is None or rang == NULL else rang)
+        xyz.append((point.x(), point.y(), point.z()))
+    sommets     = moteur.grouper_sommets(moteur.magasin_sommets(ids, rangs,
+                                                                xyz))
+    numeros, bornes = moteur.bornes_lignes(sommets)
+    valeurs     = list(groupes)         #Valeur de id_cana de chaque numéro
+
+    #Couche de sortie : une ligne par valeur de id_cana
+    champs      = QgsFields()
+    champs.append(points.fields().field(index_id))
+    avec_z      = QgsWkbTypes.hasZ(points.wkbType())
+    ligne       = QgsMemoryProviderUtils.createMemoryLayer(
+        'Chemins', champs,
+        QgsWkbTypes.LineStringZ if avec_z else QgsWkbTypes.LineString,
+        points.crs())
+    entites     = []
+    for rang, numero in enumerate(numeros.tolist()) :
+        geometrie = geometrie_ligne(sommets, bornes[rang], bornes[rang + 1],
+                                    avec_z)
+        if geometrie is None :
+            continue
+        entite = QgsFeature(champs)
+        entite.setAttributes([valeurs[numero]])
+        entite.setGeometry(geometrie)
+        entites.append(entite)
+    ligne.dataProvider().addFeatures(entites)
+    ligne.updateExtents()
+
+    return ligne
 
 
 def jointure_attributaire(couche1, couche2, champ_jointure) :
@@ -153,10 +349,34 @@ def jointure_attributaire(couche1, couche2, champ_jointure) :
     return jointure['OUTPUT']
 
 
+def entites_filtrees(topo, filtre) : 
+    '''Entités (avec géométrie) de la couche topo qui respectent le filtre. Un
+    filtre de la forme champ LIKE/IN ... OR ... est compilé par le moteur et 
+    évalué d'un bloc sur toute la colonne, sinon il est confié à Qgis'''
+    predicat = moteur.compiler_filtre(filtre)
+    index    = topo.fields().lookupField(predicat.champ) if predicat else -1
+    if index < 0 :                                      #Expression Qgis
+        requete = QgsFeatureRequest().setFilterExpression(filtre)
+        return [f for f in topo.getFeatures(requete) if f.hasGeometry()]
+    
+    entites = [f for f in topo.getFeatures() if f.hasGeometry()]
+    valeurs = [None if v == NULL else v 
+               for v in (f.attribute(index) for f in entites)]
+    masque  = predicat({predicat.champ : valeurs})      #Colonne entière
+    return [f for f, garder in zip(entites, masque) if garder]
+
 def topo_pertinente(topo, filtre) : 
     '''Récupération des points topographiques qui sont intesectés à la 
     canalisation'''
     
+    #Filtre compilé : évalué sur toute la colonne, sans moteur d'expressions
+    if moteur.compiler_filtre(filtre) is not None : 
+        topo_res = QgsMemoryProviderUtils.createMemoryLayer(
+            'Correspondance', topo.fields(), topo.wkbType(), topo.crs())
+        topo_res.dataProvider().addFeatures(entites_filtrees(topo, filtre))
+        topo_res.updateExtents()
+        return topo_res
+    
     #Effectuer l'extraction sur ce filtre
     topo_res = processing.run('native:extractbyexpression', 
                               {'EXPRESSION' : filtre, 
@@ -227,12 +447,24 @@ def copier_coller_enties(couche_source, couche_cible) :
     return couche_cible
 
 
-def comptage(couche) : 
-    '''Compte du nombre d'entités de la couche en entrée'''
+def comptage(couche) :
+    '''Compte du nombre d'entités de la couche en entrée : nombre tenu par le
+    fournisseur de données, parcours des entités s'il ne le connaît pas'''
+    compte  = couche.featureCount()
+    if compte >= 0 :                #Connu sans parcourir la couche
+        return compte
     compte  = 0
     for f in couche.getFeatures() : #Pour chaque entité
         compte += 1                 #Incrémente un compteur
     return compte
+
+def compter_resultat(suivi, cana, cana_recalee, doublons) :
+    '''Garde dans le suivi les comptages de contrôle de info() : ils sont
+    relevés à la fin du traitement, sans parcourir les couches'''
+    instrumentation.compter(suivi, 'canalisations_source',   comptage(cana))
+    instrumentation.compter(suivi, 'canalisations_resultat',
+                            comptage(cana_recalee))
+    instrumentation.compter(suivi, 'points_a_recaler',       comptage(doublons))
         
 def pop_up(chiffre1, chiffre2, chiffre3) : 
     '''Affiche un message d'information dans une pop up'''
@@ -249,91 +481,624 @@ compte dans le recalage (couche A_RECALER_MANUELLEMENT). \n\n ATTENTION : les \
 couches en résultat sont des couches temporaires. Pensez à les enregistrer' )
 
     
-def prepa_points(cana, topo, id_cana, filtre) : 
+def sommets_identifies(cana) : 
+    '''Extraction des sommets et identification de chacun (champ UI)
+    Sortie : Couche temporaire'''
+    sommets = extraire_sommets(cana)            #Extraction des sommets
+    creation_champ(sommets, 'UI', QVariant.Int) #Création du champs UI
+    identifiant_unique(sommets, 'UI')           #Identification des sommets (UI)
+    return sommets
+
+def prepa_points(cana, topo, id_cana, filtre, distance_max=None, k=1, 
+                 methode=None, suivi=None, paralleles=False) : 
     '''Prépare des couches de ponctuels pour les mettre sous forme de lignes
     Entrées : cana = Canalisation, topo = topographie, id_cana = identifiant 
     unique de canalisation, filtre = formule pour garder les points 
-    topographiques pertinents
+    topographiques pertinents, distance_max, k, methode = paramètres 
+    d'accrochage (voir jointure_proche_sommet), suivi = mesure des étapes
+    (voir PY3_INSTRUMENTATION_V1.py, None = pas de mesure), paralleles = 
+    extraction des sommets et choix de la topo en même temps (voir 
+    PY3_ORDONNANCEUR_V1.py)
     Sortie : res      = points pour la traçage de la canalisation 
              doublons = Points exclus du traçage'''
     
-    sommets      = extraire_sommets(cana)    #Extraction des sommets de la ligne
-    creation_champ(cana, 'UI')                  #Création du champs UI
-    identifiant_unique(sommets, 'UI')           #Identification des sommets (UI)
-    sommets_topo = topo_pertinente(topo, filtre) #Choix de la topo pertinente
+    #Sommets des canalisations et choix de la topo, indépendants : les sommets
+    #dans le fil courant, la topo sur une copie faite ici (fil principal)
+    with instrumentation.etape(suivi, 'sommets_et_topo', 
+                               cana.featureCount() 
+                               + topo.featureCount()) as mesure : 
+        copie        = ordonnanceur.copie_pour_branche
+        branches     = ordonnanceur.executer(
+            {'sommets' : (sommets_identifies, cana), 
+             'topo'    : (topo_pertinente, copie(topo, paralleles), filtre)}, 
+            paralleles, ordonnanceur.rendre_au_fil_principal)
+        sommets      = branches['sommets']      #Sommets identifiés (UI)
+        sommets_topo = branches['topo']         #Choix de la topo
+        mesure['sorties'] = sommets.featureCount() \
+                            + sommets_topo.featureCount()
+    instrumentation.compter(suivi, 'sommets', sommets.featureCount())
+    instrumentation.compter(suivi, 'points_topo_retenus', 
+                            sommets_topo.featureCount())
     
     #jointure au plus proche sommet
-    sommets_res  = jointure_proche_sommet(sommets_topo, sommets)
+    with instrumentation.etape(suivi, 'jointure_proche_sommet', 
+                               sommets_topo.featureCount()) as mesure : 
+        sommets_res  = jointure_proche_sommet(sommets_topo, sommets, 
+                                              distance_max, k, methode)
+        mesure['sorties'] = sommets_res.featureCount()
     
     #Séparation des doublons
-    sommets_res  = separer_doublons(sommets_res, 'UI') #Renvoie deux couches : 
-    points_res   = sommets_res[0]                      #Les points valides
-    doublons     = sommets_res[1]                      #Les points non attribués
-    nettoyer(topo, doublons)                      #Nettoie la table des doublons
-    doublons.setName('A_RECALER_MANUELLEMENT')    #Renommage des doublons
-    
-    #Jointure des points topo
-    points = jointure_attributaire(sommets, points_res, 'UI')
+    with instrumentation.etape(suivi, 'separer_doublons', 
+                               sommets_res.featureCount()) as mesure : 
+        sommets_res  = separer_doublons(sommets_res, 'UI') #Renvoie deux couches
+        points_res   = sommets_res[0]                      #Les points valides
+        doublons     = sommets_res[1]                      #Les non attribués
+        nettoyer(topo, doublons)                  #Nettoie la table des doublons
+        doublons.setName('A_RECALER_MANUELLEMENT')    #Renommage des doublons
+        mesure['sorties'] = points_res.featureCount()
     
-    #Quand il existe un ancien point, supression
-    #X est non null, alors il y a un point topo, on sélectionne et on supprime
-    points = extraire_entites(points)
-    points   = nettoyer2(points, id_cana)           #Nettoyage de la table
-    resultat = nettoyer2(sommets_res[0], id_cana)   #Nettoyage de la table
-    
-    #Copier/coller des points topo nouveaux
-    res = copier_coller_enties(points, resultat)
-    res.setName('POINTS_PRETS')                     #Renommage de res
+    with instrumentation.etape(suivi, 'preparer_points', 
+                               sommets.featureCount()) as mesure : 
+        #Jointure des points topo
+        points = jointure_attributaire(sommets, points_res, 'UI')
+        
+        #Quand il existe un ancien point, supression
+        #X est non null, alors il y a un point topo, on sélectionne et on 
+        #supprime
+        points = extraire_entites(points)
+        points   = nettoyer2(points, id_cana)           #Nettoyage de la table
+        resultat = nettoyer2(sommets_res[0], id_cana)   #Nettoyage de la table
+        
+        #Copier/coller des points topo nouveaux
+        res = copier_coller_enties(points, resultat)
+        res.setName('POINTS_PRETS')                     #Renommage de res
+        mesure['sorties'] = res.featureCount()
     
     return res, doublons
 
-def main(cana, topo, id_cana, filtre) :
+def main(cana, topo, id_cana, filtre, distance_max=None, k=1, methode=None, 
+         suivi=None, paralleles=False) :
     '''Dessine la canalisation sur les points topographiques en entrée
     Entrées : cana = Canalisation, topo = topographie, id_cana = identifiant 
     unique de canalisation, filtre = formule pour garder les points 
-    topographiques pertinents
+    topographiques pertinents, distance_max, k, methode = paramètres 
+    d'accrochage (voir jointure_proche_sommet), suivi = mesure des étapes,
+    paralleles = voir prepa_points
     Sortie  : - cana_recalee = nouvelle canalisation calée sur des poinst topo
               - doublons     = Points exclus du traçage'''
     
     #Mise en forme des couches de points
-    points_prets    = prepa_points(cana, topo, id_cana, filtre)
+    points_prets    = prepa_points(cana, topo, id_cana, filtre, distance_max, 
+                                   k, methode, suivi, paralleles)
     resultat_points = points_prets[0]
     doublons        = points_prets[1]
     
     #Points vers lignes : 
-    cana_recalee = points_vers_lignes(resultat_points, id_cana)
+    with instrumentation.etape(suivi, 'points_vers_lignes', 
+                               resultat_points.featureCount()) as mesure : 
+        cana_recalee = points_vers_lignes(resultat_points, id_cana)
+        mesure['sorties'] = cana_recalee.featureCount()
     #Jointure attributaire pour récupérer la sémantique des linéaires
-    cana_recalee = jointure_attributaire(cana_recalee, cana, id_cana)
-    cana_recalee.setName('CANALISATION_RECALEE')        #Renommage de la couche
+    with instrumentation.etape(suivi, 'jointure_attributaire', 
+                               cana_recalee.featureCount()) as mesure : 
+        cana_recalee = jointure_attributaire(cana_recalee, cana, id_cana)
+        cana_recalee.setName('CANALISATION_RECALEE')    #Renommage de la couche
+        mesure['sorties'] = cana_recalee.featureCount()
     
+    compter_resultat(suivi, cana, cana_recalee, doublons)
     return cana_recalee, doublons
 
-def info(couche1, couche2, couche3) : 
+def lire_sommets(cana) : 
+    '''Lit en une passe les sommets de chaque canalisation dans un magasin en
+    colonnes (id de l'entité, vertex_index, x, y, z : voir SOMMET dans 
+    PY3_MOTEUR_RECALAGE_V1.py), sans créer d'entité par sommet
+    Entrées : cana = Canalisation
+    Sortie  : magasin trié par entité puis par vertex_index'''
+    ids     = []
+    rangs   = []
+    xyz     = []
+    requete = QgsFeatureRequest().setNoAttributes()
+    for feature in cana.getFeatures(requete) :          #Pour chaque linéaire
+        if feature.hasGeometry() : 
+            points = [(sommet.x(), sommet.y(), sommet.z()) #z = nan en 2D
+                      for sommet in feature.geometry().vertices()]
+            ids   += [feature.id()] * len(points)
+            rangs += range(len(points))
+            xyz   += points
+    return moteur.grouper_sommets(moteur.magasin_sommets(ids, rangs, xyz))
+
+def coordonnees_sommets(sommets) : 
+    '''Tableau (n, 2) des coordonnées X Y du magasin lu par lire_sommets'''
+    return np.column_stack([sommets['x'], sommets['y']])
+
+def indexer_sommets(sommets) : 
+    '''Construit l'index KD-tree des sommets lus par lire_sommets, dans 
+    l'ordre du magasin'''
+    return moteur.indexer_sommets(coordonnees_sommets(sommets))
+
+def sommets_indexes(cana, dossier_index=None, taille_max_index=None, 
+                    avec_index=True) : 
+    '''Sommets des canalisations (voir lire_sommets) et leur index KD-tree.
+    Avec dossier_index, les deux sont relus sur disque s'ils y sont déjà pour
+    ce fichier de canalisations (voir PY3_INDEX_SPATIAL_V1.py), sinon lus, 
+    indexés puis gardés. Le magasin relu est projeté en mémoire en copie sur
+    écriture : la substitution des sommets ne touche pas au cache
+    Sortie : sommets, index (None si avec_index = False, sans cache)'''
+    cle = None
+    if dossier_index : 
+        cle   = index_spatial.cle_couche(cana, dossier_index, 'sommets')
+        garde = index_spatial.lire_cache(dossier_index, cle, mode='c')
+        if garde is not None : 
+            return garde['sommets'], garde['index']
+    
+    sommets = lire_sommets(cana)
+    if cle is None and not avec_index : 
+        return sommets, None
+    index   = indexer_sommets(sommets)
+    if cle is not None : 
+        index_spatial.ecrire_cache(dossier_index, cle, 
+                                   {'sommets' : sommets, 'index' : index}, 
+                                   taille_max_index)
+    return sommets, index
+
+def predicat_expression(filtre) : 
+    '''Traduit le filtre (expression Qgis) en prédicat pour la lecture par 
+    blocs du CSV : l'expression est évaluée sur chaque ligne du bloc. Sert 
+    quand le filtre n'a pas une forme que le moteur sait compiler'''
+    expression = QgsExpression(filtre)
+    
+    def predicat(colonnes) : 
+        champs = QgsFields()
+        for nom in colonnes : 
+            champs.append(QgsField(nom, QVariant.String))
+        contexte = QgsExpressionContext()
+        contexte.setFields(champs)
+        expression.prepare(contexte)
+        entite   = QgsFeature(champs)
+        masque   = []
+        for valeurs in zip(*colonnes.values()) :        #Ligne par ligne
+            entite.setAttributes(list(valeurs))
+            contexte.setFeature(entite)
+            masque.append(bool(expression.evaluate(contexte)))
+        return np.array(masque, dtype=bool)
+    
+    return predicat
+
+def lire_topo(topo, filtre) : 
+    '''Charge en mémoire les seuls points topo pertinents, depuis une couche 
+    ou directement depuis l'export CSV LEICA (lecture par blocs, filtre 
+    appliqué pendant la lecture)
+    Entrées : topo = couche de points ou chemin du fichier CSV, filtre
+    Sortie  : coordonnées (n, 3) X Y Z (Z = nan si absent), attributs des 
+    points (liste des entités pour une couche, tableaux lus pour le CSV)'''
+    if isinstance(topo, str) :                          #Export CSV LEICA
+        predicat  = (moteur.compiler_filtre(filtre) 
+                     or predicat_expression(filtre))
+        attributs = moteur.lire_topo_csv(topo, predicat)
+        xyz       = np.column_stack([attributs['X'], attributs['Y'], 
+                                     attributs['Z']])
+        return xyz, attributs
+    
+    entites = entites_filtrees(topo, filtre)
+    points  = [f.geometry().vertexAt(0) for f in entites]
+    xyz     = np.array([(p.x(), p.y(), p.z() if p.is3D() else np.nan) 
+                        for p in points], dtype=np.float64).reshape(-1, 3)
+    return xyz, entites
+
+def topo_retenue(topo, filtre, dossier_index=None, taille_max_index=None) : 
+    '''Comme lire_topo ; avec dossier_index, les points retenus de l'export 
+    CSV LEICA sont relus sur disque tant que le fichier et le filtre n'ont 
+    pas changé, sinon lus puis gardés'''
+    if not dossier_index or not isinstance(topo, str) : 
+        return lire_topo(topo, filtre)
+    cle       = index_spatial.cle_cache(
+        index_spatial.empreinte_fichier(topo, dossier_index), 'topo', filtre)
+    attributs = index_spatial.lire_cache(dossier_index, cle)
+    if attributs is None : 
+        xyz, attributs = lire_topo(topo, filtre)
+        index_spatial.ecrire_cache(dossier_index, cle, attributs, 
+                                   taille_max_index)
+        return xyz, attributs
+    xyz = np.column_stack([attributs['X'], attributs['Y'], attributs['Z']])
+    return xyz, attributs
+
+def accrocher_topo(xyz, index, nb_sommets, distance_max=None, k=1, 
+                   methode=None) : 
+    '''Cherche en une requête groupée les k sommets les plus proches de chaque 
+    point topo. Sans methode, le premier point arrivé sur un sommet le garde ;
+    avec une methode d'affectation, les conflits sont résolus sur tout le 
+    réseau. Les points restés sans sommet (ou au-delà de distance_max) sont 
+    des doublons.
+    Sortie : attribution = rang du point topo de chaque sommet du magasin 
+             (-1 = aucun), rangs des points topo en doublon'''
+    distances, indices = moteur.accrocher_points(index, xyz[:, :2], k, 
+                                                 distance_max)
+    return affecter_topo(distances, indices, nb_sommets, methode)
+
+def affecter_topo(distances, indices, nb_sommets, methode=None, rangs=None) : 
+    '''Attribue les sommets aux points topo à partir de leurs candidats 
+    (voir accrocher_topo). rangs = numéros des points à traiter (tous si None)
+    Sortie : attribution = rang du point topo de chaque sommet du magasin 
+             (-1 = aucun), rangs des points topo en doublon'''
+    if rangs is None : 
+        rangs = np.arange(len(indices))
+    choix, _      = choisir_sommets(distances[rangs], indices[rangs], methode)
+    return moteur.attribuer_sommets(choix, nb_sommets, rangs)
+
+def geometrie_ligne(sommets, debut, fin, avec_z=False) : 
+    '''Géométrie de la ligne formée par les sommets du magasin entre debut et
+    fin, créée d'un bloc à partir des colonnes (None s'il n'y a pas de quoi 
+    faire une ligne)'''
+    if fin - debut < 2 :                                #Pas de ligne possible
+        return None
+    ligne = sommets[debut:fin]
+    if avec_z : 
+        return QgsGeometry(QgsLineString(ligne['x'].tolist(), 
+                                         ligne['y'].tolist(), 
+                                         ligne['z'].tolist()))
+    return QgsGeometry(QgsLineString(ligne['x'].tolist(), ligne['y'].tolist()))
+
+def reconstruire_lignes(cana, sommets) : 
+    '''Reconstruit les linéaires à partir du magasin des sommets (points topo
+    déjà substitués) et reporte directement la sémantique de la couche source
+    Sortie : couche temporaire CANALISATION_RECALEE'''
+    avec_z    = QgsWkbTypes.hasZ(cana.wkbType())
+    type_geom = QgsWkbTypes.LineStringZ if avec_z else QgsWkbTypes.LineString
+    resultat  = QgsMemoryProviderUtils.createMemoryLayer(
+        'CANALISATION_RECALEE', cana.fields(), type_geom, cana.crs())
+    
+    #Lignes du magasin : sommets de la i-ème entre bornes[i] et bornes[i + 1]
+    ids, bornes = moteur.bornes_lignes(sommets)
+    rang_ligne  = {fid : rang for rang, fid in enumerate(ids.tolist())}
+    
+    entites     = []
+    for feature in cana.getFeatures() : 
+        rang = rang_ligne.get(feature.id())
+        if rang is None :                               #Pas de géométrie
+            continue
+        geometrie = geometrie_ligne(sommets, bornes[rang], bornes[rang + 1], 
+                                    avec_z)
+        if geometrie is None : 
+            continue
+        entite = QgsFeature(resultat.fields())
+        entite.setAttributes(feature.attributes())
+        entite.setGeometry(geometrie)
+        entites.append(entite)
+    resultat.dataProvider().addFeatures(entites)
+    resultat.updateExtents()
+    
+    return resultat
+
+def couche_doublons(topo, attributs, rangs, crs) : 
+    '''Range les points topo non attribués dans une couche temporaire
+    Entrées : topo = couche ou fichier CSV source, attributs = sortie de 
+    lire_topo, rangs = rangs des points non attribués, crs = système de 
+    coordonnées à utiliser pour un CSV
+    Sortie : couche temporaire A_RECALER_MANUELLEMENT'''
+    if not isinstance(topo, str) :                      #Couche : entités copiées
+        doublons = QgsMemoryProviderUtils.createMemoryLayer(
+            'A_RECALER_MANUELLEMENT', topo.fields(), topo.wkbType(), 
+            topo.crs())
+        doublons.dataProvider().addFeatures([attributs[r] for r in rangs])
+        doublons.updateExtents()
+        return doublons
+    
+    #CSV : création des entités à partir des tableaux lus
+    champs = QgsFields()
+    for nom in attributs : 
+        if nom in ('X', 'Y', 'Z') : 
+            champs.append(QgsField(nom, QVariant.Double))
+        else : 
+            champs.append(QgsField(nom, QVariant.String))
+    doublons = QgsMemoryProviderUtils.createMemoryLayer(
+        'A_RECALER_MANUELLEMENT', champs, QgsWkbTypes.Point, crs)
+    entites  = []
+    for rang in rangs : 
+        valeurs = [attributs[nom][rang].item() for nom in attributs]
+        entite  = QgsFeature(champs)
+        entite.setAttributes([None if valeur != valeur else valeur #nan = vide
+                              for valeur in valeurs])
+        entite.setGeometry(QgsGeometry(QgsPoint(float(attributs['X'][rang]), 
+                                                float(attributs['Y'][rang]))))
+        entites.append(entite)
+    doublons.dataProvider().addFeatures(entites)
+    doublons.updateExtents()
+    
+    return doublons
+
+def pipeline_recalage(cana, topo, id_cana, filtre, distance_max=None, k=1, 
+                      methode=None, processus=1, halo=None, suivi=None, 
+                      dossier_index=None, taille_max_index=None, 
+                      segments=False, tolerance_sommet=0.5, 
+                      seuil_deplacement=None, seuil_longueur=None) : 
+    '''Dessine la canalisation sur les points topographiques en une seule 
+    passe : les étapes s'échangent les entités en mémoire, sans couche 
+    temporaire intermédiaire
+    Entrées : cana = Canalisation, topo = topographie (couche ou chemin de 
+    l'export CSV LEICA), id_cana = identifiant unique de canalisation, 
+    filtre = formule pour garder les points topographiques pertinents, 
+    distance_max = distance d'accrochage maximale,
+    k = nombre de sommets candidats, methode = méthode d'affectation, 
+    processus = nombre de processus (1 = calcul dans Qgis), halo = 
+    élargissement des tuiles en calcul parallèle, suivi = mesure des étapes
+    (voir PY3_INSTRUMENTATION_V1.py, None = pas de mesure), dossier_index et
+    taille_max_index = sommets indexés et topo gardés sur disque (voir 
+    sommets_indexes et topo_retenue), segments = projection sur les segments
+    au lieu de l'accrochage aux sommets (voir recaler_segments dans 
+    PY3_MOTEUR_RECALAGE_V1.py, avec tolerance_sommet), seuil_deplacement et
+    seuil_longueur = seuils du contrôle (voir controle_recalage)
+    Sortie  : - cana_recalee = nouvelle canalisation calée sur des points topo
+              - doublons     = Points exclus du traçage
+              - controle     = Canalisations signalées par le contrôle'''
+    sommets, index, xyz, attributs = lire_entrees(
+        cana, topo, filtre, suivi, dossier_index, taille_max_index, 
+        processus == 1 and not segments)
+    avant = np.array(sommets)                   #Sommets d'origine (contrôle)
+    
+    if segments :                               #Projection sur les segments
+        with instrumentation.etape(suivi, 'projection_segments', 
+                                   len(xyz)) as mesure : 
+            sommets, remplaces, inseres, rangs_doublons, origine = \
+                moteur.recaler_segments(sommets, xyz, distance_max, 
+                                        tolerance_sommet)
+            mesure['sorties'] = remplaces + inseres
+        instrumentation.compter(suivi, 'sommets_remplaces', remplaces)
+        instrumentation.compter(suivi, 'sommets_inseres',   inseres)
+        cana_recalee, doublons = ecrire_resultat(cana, sommets, topo, 
+                                                 attributs, rangs_doublons, 
+                                                 suivi)
+        controle = controle_recalage(cana, id_cana, avant, sommets, origine, 
+                                     seuil_deplacement, seuil_longueur, suivi)
+        return cana_recalee, doublons, controle
+    
+    #Accrochage au plus proche sommet et séparation des doublons
+    with instrumentation.etape(suivi, 'accrochage', len(xyz)) as mesure : 
+        if processus != 1 :                         #Tuiles sur plusieurs coeurs
+            _, _, choix   = moteur.recaler_parallele(
+                coordonnees_sommets(sommets), xyz[:, :2], k, distance_max, 
+                methode, processus, halo)
+            attribution, rangs_doublons = moteur.attribuer_sommets(
+                choix, len(sommets))
+        else : 
+            attribution, rangs_doublons = accrocher_topo(
+                xyz, index, len(sommets), distance_max, k, methode)
+        
+        #Substitution en place dans le magasin des sommets
+        remplaces = moteur.substituer_sommets(sommets, attribution, xyz)
+        mesure['sorties'] = remplaces
+    instrumentation.compter(suivi, 'sommets_remplaces', remplaces)
+    
+    #Reconstruction des lignes avec la sémantique d'origine
+    cana_recalee, doublons = ecrire_resultat(cana, sommets, topo, attributs, 
+                                             rangs_doublons, suivi)
+    controle = controle_recalage(cana, id_cana, avant, sommets, None, 
+                                 seuil_deplacement, seuil_longueur, suivi)
+    return cana_recalee, doublons, controle
+
+def lire_entrees(cana, topo, filtre, suivi=None, dossier_index=None, 
+                 taille_max_index=None, avec_index=True) : 
+    '''Lecture des sommets des canalisations (et de leur index) et de la topo
+    pertinente, étapes mesurées dans suivi
+    Sortie : sommets et index (voir sommets_indexes), xyz et attributs (voir
+    lire_topo)'''
+    with instrumentation.etape(suivi, 'lire_sommets', 
+                               cana.featureCount()) as mesure : 
+        sommets, index = sommets_indexes(cana, dossier_index, #Sommets et index
+                                         taille_max_index, avec_index)
+        mesure['sorties'] = len(sommets)
+    instrumentation.compter(suivi, 'sommets', len(sommets))
+    
+    entrees = None if isinstance(topo, str) else topo.featureCount()
+    with instrumentation.etape(suivi, 'lire_topo', entrees) as mesure : 
+        xyz, attributs = topo_retenue(topo, filtre, #Topo pertinente
+                                      dossier_index, taille_max_index)
+        mesure['sorties'] = len(xyz)
+    instrumentation.compter(suivi, 'points_topo_retenus', len(xyz))
+    return sommets, index, xyz, attributs
+
+def ecrire_resultat(cana, sommets, topo, attributs, rangs_doublons, 
+                    suivi=None) : 
+    '''Reconstruction des lignes et couche des points à recaler, étapes 
+    mesurées dans suivi
+    Sortie  : - cana_recalee = nouvelle canalisation calée sur des points topo
+              - doublons     = Points exclus du traçage'''
+    with instrumentation.etape(suivi, 'reconstruire_lignes', 
+                               len(sommets)) as mesure : 
+        cana_recalee = reconstruire_lignes(cana, sommets)
+        mesure['sorties'] = cana_recalee.featureCount()
+    with instrumentation.etape(suivi, 'couche_doublons', 
+                               len(rangs_doublons)) as mesure : 
+        doublons     = couche_doublons(topo, attributs, rangs_doublons, 
+                                       cana.crs())
+        mesure['sorties'] = doublons.featureCount()
+    
+    compter_resultat(suivi, cana, cana_recalee, doublons)
+    return cana_recalee, doublons
+
+def couche_controle(cana, id_cana, sommets, bilan, motifs) : 
+    '''Couche compacte des canalisations signalées : un point sur le sommet 
+    le plus déplacé de chacune, avec son bilan
+    Entrées : sommets = magasin après recalage, bilan et motifs = sorties de
+    controler_deplacements et signaler_lignes, réduites aux lignes signalées
+    Sortie  : couche temporaire CONTROLE_RECALAGE'''
+    sortie = QgsFields()
+    if id_cana : 
+        sortie.append(QgsField(cana.fields().field(id_cana)))
+    for nom, genre in (('SOMMETS_DEPLACES',  QVariant.Int), 
+                       ('DEPLACEMENT_MAX',   QVariant.Double), 
+                       ('DEPLACEMENT_MOYEN', QVariant.Double), 
+                       ('SOMMETS_INSERES',   QVariant.Int), 
+                       ('LONGUEUR_AVANT',    QVariant.Double), 
+                       ('LONGUEUR_APRES',    QVariant.Double), 
+                       ('MOTIF',             QVariant.String)) : 
+        sortie.append(QgsField(nom, genre))
+    controle = QgsMemoryProviderUtils.createMemoryLayer(
+        'CONTROLE_RECALAGE', sortie, QgsWkbTypes.Point, cana.crs())
+    
+    #Identifiants des seules canalisations signalées
+    cles = {}
+    if id_cana and len(bilan['id']) : 
+        requete = QgsFeatureRequest().setFilterFids(bilan['id'].tolist())
+        requete.setSubsetOfAttributes([id_cana], cana.fields())
+        requete.setFlags(QgsFeatureRequest.NoGeometry)
+        cles = {f.id() : f[id_cana] for f in cana.getFeatures(requete)}
+    
+    libelles = {1 : 'DEPLACEMENT', 2 : 'LONGUEUR', 
+                3 : 'DEPLACEMENT ET LONGUEUR'}
+    colonnes = [bilan[nom].tolist() for nom in ('id', 'sommets_deplaces', 
+                'deplacement_max', 'deplacement_moyen', 'sommets_inseres', 
+                'longueur_avant', 'longueur_apres', 'rang_max')]
+    entites  = []
+    for fid, deplaces, d_max, d_moyen, inseres, l_avant, l_apres, rang, \
+        motif in zip(*colonnes, motifs.tolist()) : 
+        entite  = QgsFeature(sortie)
+        valeurs = [cles.get(fid)] if id_cana else []
+        entite.setAttributes(valeurs + [deplaces, d_max, d_moyen, inseres, 
+                                        l_avant, l_apres, libelles[motif]])
+        entite.setGeometry(QgsGeometry(QgsPoint(float(sommets['x'][rang]), 
+                                                float(sommets['y'][rang]))))
+        entites.append(entite)
+    controle.dataProvider().addFeatures(entites)
+    controle.updateExtents()
+    
+    return controle
+
+def controle_recalage(cana, id_cana, avant, apres, origine=None, 
+                      seuil_deplacement=None, seuil_longueur=None, 
+                      suivi=None) : 
+    '''Contrôle du recalage, calculé d'un bloc sur les magasins de sommets :
+    déplacement de chaque sommet, et par canalisation déplacement maximal et
+    moyen et changement de longueur (voir controler_deplacements dans 
+    PY3_MOTEUR_RECALAGE_V1.py). Les canalisations au-delà des seuils sont 
+    signalées (voir signaler_lignes)
+    Entrées : avant, apres = magasins avant et après recalage, origine = rang
+    dans apres de chaque sommet d'avant (sommets insérés)
+    Sortie  : couche temporaire CONTROLE_RECALAGE'''
+    with instrumentation.etape(suivi, 'controle_deplacements', 
+                               len(avant)) as mesure : 
+        deplacement, bilan = moteur.controler_deplacements(avant, apres, 
+                                                           origine)
+        signales, motifs = moteur.signaler_lignes(bilan, seuil_deplacement, 
+                                                  seuil_longueur)
+        mesure['sorties'] = int(signales.sum())
+    instrumentation.compter(suivi, 'sommets_deplaces', 
+                            bilan['sommets_deplaces'].sum())
+    instrumentation.compter(suivi, 'canalisations_signalees', signales.sum())
+    
+    with instrumentation.etape(suivi, 'couche_controle', 
+                               int(signales.sum())) as mesure : 
+        controle = couche_controle(
+            cana, id_cana, apres, 
+            {nom : valeurs[signales] for nom, valeurs in bilan.items()}, 
+            motifs[signales])
+        mesure['sorties'] = controle.featureCount()
+    return controle
+
+def pipeline_incremental(cana, topo, id_cana, filtre, fichier_cache, 
+                         distance_max=None, k=1, methode=None, suivi=None, 
+                         dossier_index=None, taille_max_index=None, 
+                         seuil_deplacement=None, seuil_longueur=None) : 
+    '''Comme pipeline_recalage, mais ne refait l'accrochage et l'affectation
+    que dans les groupes (points topo et canalisations candidates reliés 
+    entre eux) touchés depuis le dernier passage par une canalisation ou un 
+    point topo modifié, ajouté ou supprimé (voir recaler_incremental dans 
+    PY3_INCREMENTAL_V1.py). Les autres canalisations reprennent leurs sommets
+    recalés du cache fichier_cache (.npz), qui est ensuite mis à jour. Le 
+    résultat est le même qu'un passage complet. suivi = mesure des étapes 
+    (None = pas de mesure), dossier_index, taille_max_index et seuils du 
+    contrôle : voir pipeline_recalage
+    Sortie  : - cana_recalee = nouvelle canalisation calée sur des points topo
+              - doublons     = Points exclus du traçage
+              - controle     = Canalisations signalées par le contrôle'''
+    sommets, index, xyz, attributs = lire_entrees(
+        cana, topo, filtre, suivi, dossier_index, taille_max_index, 
+        avec_index=False)                               #Index fait au besoin
+    avant      = np.array(sommets)                      #Sommets d'origine
+    parametres = incremental.empreinte(filtre, distance_max, k, methode)
+    
+    with instrumentation.etape(suivi, 'recalage_incremental', 
+                               len(xyz)) as mesure : 
+        cache = incremental.charger_cache(fichier_cache)
+        rangs_doublons, lignes_a_faire, cache, recalcules = \
+            incremental.recaler_incremental(sommets, xyz, cache, parametres, 
+                                            distance_max, k, methode, index)
+        mesure['sorties'] = recalcules
+    instrumentation.compter(suivi, 'points_recalcules', recalcules)
+    instrumentation.compter(suivi, 'canalisations_recalculees', 
+                            lignes_a_faire.sum())
+    
+    cana_recalee, doublons = ecrire_resultat(cana, sommets, topo, attributs, 
+                                             rangs_doublons, suivi)
+    controle = controle_recalage(cana, id_cana, avant, sommets, None, 
+                                 seuil_deplacement, seuil_longueur, suivi)
+    
+    #Mise à jour du cache pour le prochain passage
+    incremental.enregistrer_cache(fichier_cache, cache)
+    
+    return cana_recalee, doublons, controle
+
+def info(couche1, couche2, couche3, compteurs=None) : 
     '''Renvoie une pop up avec les informaions de contrôle : 
     Le nombre d'entités dans la couche linéaire source 
     Le nombre d'entités dans la couche linéaire en sortie
-    Le nombre d'entités dans la couche pontuelle de la topo non intégrée'''
-    nb_source = comptage(couche1) # compte le nombre d'entités dans cana
-    nb_cible  = comptage(couche2) # compte le nombre d'entités dans cana_recalee
-    doublons  = comptage(couche3) # compte le nombre d'entités dans doublons
+    Le nombre d'entités dans la couche pontuelle de la topo non intégrée
+    compteurs = comptages relevés pendant le traitement (rapport du suivi) : 
+    les couches ne sont comptées que s'ils manquent'''
+    compteurs = compteurs or {}
+    nb_source = compteurs.get('canalisations_source')   # entités dans cana
+    nb_cible  = compteurs.get('canalisations_resultat') # dans cana_recalee
+    doublons  = compteurs.get('points_a_recaler')       # dans doublons
+    if None in (nb_source, nb_cible, doublons) : 
+        nb_source = comptage(couche1) # compte le nombre d'entités dans cana
+        nb_cible  = comptage(couche2) # compte les entités dans cana_recalee
+        doublons  = comptage(couche3) # compte le nombre d'entités dans doublons
     infobulle = pop_up(nb_source, nb_cible, doublons) #Affichage info-bulle
 
 #_______________________________________________________________________________
 
 ####                             SCRIPT PRINCIPAL                           ####
 
-#Récupération de la couche de nom contenu dans la variable canalisation et de la
-#couche de nom contenu dans la variable points_topo
-cana = QgsProject.instance().mapLayersByName(canalisation)[0]
-topo = QgsProject.instance().mapLayersByName(points_topo)[0]
+#Lancé depuis la console Python de Qgis (ou directement) : pas à l'import du
+#fichier comme module (ligne de commande PY3_LIGNE_COMMANDE_V1.py)
+if __name__ in ('__main__', '__console__') : 
+
+    #Récupération de la couche de nom contenu dans la variable canalisation et 
+    #de la couche de nom contenu dans la variable points_topo
+    cana = QgsProject.instance().mapLayersByName(canalisation)[0]
+    if points_topo.lower().endswith('.csv') :  #Export CSV LEICA lu directement
+        topo = points_topo
+    else : 
+        topo = QgsProject.instance().mapLayersByName(points_topo)[0]
 
-#Lancement de la création du linéaire recalé
-resultat = main(cana, topo, id_cana, filtre)[0]
-doublons = main(cana, topo, id_cana, filtre)[1]
+    #Lancement de la création du linéaire recalé (une seule exécution), 
+    #chaque étape mesurée
+    suivi    = instrumentation.nouveau_suivi('recalage', mesure_memoire)
+    controle = None                             #Contrôle : mode_pipeline
+    if mode_pipeline and fichier_cache and not mode_segments : 
+        resultat, doublons, controle = pipeline_incremental(
+            cana, topo, id_cana, filtre, fichier_cache, distance_max, 
+            k_voisins, methode_affectation, suivi, dossier_index, 
+            taille_max_index, seuil_deplacement, seuil_longueur)
+    elif mode_pipeline : 
+        resultat, doublons, controle = pipeline_recalage(
+            cana, topo, id_cana, filtre, distance_max, k_voisins, 
+            methode_affectation, processus, halo, suivi, dossier_index, 
+            taille_max_index, mode_segments, tolerance_sommet, 
+            seuil_deplacement, seuil_longueur)
+    else : 
+        resultat, doublons = main(cana, topo, id_cana, filtre, distance_max, 
+                                  k_voisins, methode_affectation, suivi, 
+                                  branches_paralleles)
+    rapport = instrumentation.terminer(suivi)
+    if fichier_rapport :                            #Rapport des étapes
+        instrumentation.enregistrer_rapport(rapport, fichier_rapport)
 
-#Ajout des couches dans le projet
-QgsProject.instance().addMapLayer(resultat)    #Canalisations recallées
-QgsProject.instance().addMapLayer(doublons)    #A recaller manuellement
+    #Ajout des couches dans le projet
+    QgsProject.instance().addMapLayer(resultat)    #Canalisations recallées
+    QgsProject.instance().addMapLayer(doublons)    #A recaller manuellement
+    if controle is not None :                      #Canalisations signalées
+        QgsProject.instance().addMapLayer(controle)
 
-#Pop up : comparaison entre le nombre de canalisations en entrée et en résultat 
-info(cana, resultat, doublons)
\ No newline at end of file
+    #Pop up : comparaison entre le nombre de canalisations en entrée et en 
+    #résultat (comptages relevés pendant le traitement)
+    info(cana, resultat, doublons, rapport['compteurs'])
\ No newline at end of file
@@ -0,0 +1,486 @@
+#! /urs/bin/env python3
+# coding: utf-8
+
+'''
+BANC D'ESSAI : RESEAUX SYNTHETIQUES ET MESURE DES ETAPES DE TRAITEMENT
+Date          : 17/10/2026
+Version       : 1
+Compatibilité : Qgis 3 (bibliothèques Python de Qgis, sans lancer l'interface)
+                L'option --sans-qgis ne mesure que les moteurs numpy/scipy
+But           : Générer des réseaux de canalisations synthétiques (graine fixe :
+                même réseau d'un lancement à l'autre), avec regards et points
+                topo bruités, doublons et points hors filtre, puis chronométrer
+                chaque étape du recalage et de l'amont/aval à plusieurs tailles
+                (débit et pic mémoire), pour repérer les régressions et
+                dimensionner les machines
+Utilisation   : Dans un terminal où Python connaît Qgis (OSGeo4W Shell sous
+                Windows, par exemple) :
+                python PY3_BENCHMARK_V1.py --tailles 10000 100000 1000000
+                    --sortie BENCHMARK.csv
+                python PY3_BENCHMARK_V1.py --sans-qgis (moteurs seuls)
+                python PY3_BENCHMARK_V1.py --help (toutes les options)
+Entrées       : Tailles des réseaux (nombre de sommets), paramètres du
+                générateur
+Sorties       : Tableau affiché dans le terminal, et fichier .csv ou .json si
+                --sortie est renseigné. Pour chaque taille et chaque étape :
+                entités en entrée et en sortie, durée (meilleure des
+                répétitions), débit (entités en entrée par seconde) et pic
+                mémoire (allocations Python et numpy de l'étape, suivies par
+                tracemalloc dans un second passage, hors chronométrage : la
+                mémoire propre à Qgis, en C++, n'y est pas)
+'''
+
+#_______________________________________________________________________________
+
+####                             PARTIE FONCTIONS                           ####
+
+#Imports de modules (Qgis et les scripts ne sont chargés qu'une fois les
+#arguments lus, et pas du tout avec --sans-qgis)
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+DOSSIER_SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+if DOSSIER_SCRIPTS not in sys.path :
+    sys.path.append(DOSSIER_SCRIPTS)
+import PY3_GRAPHE_RESEAU_V1   as graphe_reseau
+import PY3_INDEX_SPATIAL_V1   as index_spatial
+import PY3_MOTEUR_RECALAGE_V1 as moteur
+
+#Filtre des points topo (celui de PY3_AEP_RECALAGE_CANA_V2.py) et codes tirés
+FILTRE       = ("Profondeur like '%BRANCHEMENT%' or Profondeur like 'VANNE%' "
+                "or Profondeur like '%VENTOUSE%' or Profondeur like '%PURGE%' "
+                "or Profondeur like '%VIDANGE%' or Profondeur like '%PI%' "
+                "or Profondeur like '%BI%'")
+CODES        = np.array(['BRANCHEMENT', 'VANNE', 'VENTOUSE', 'PURGE',
+                         'VIDANGE', 'PI', 'BI'])
+CODE_EXCLU   = 'TN'                                     #Terrain naturel
+CHAMPS_REGARDS = ['NUM_REG', 'Z_RELEVE', 'PROFONDEUR', 'CLASSE']
+
+
+def generer_reseau(nb_sommets, graine=0, sommets_par_cana=10, pas=5.0,
+                   branches=3, canas_par_arbre=40, densite=0.02, bruit=0.2,
+                   part_topo=0.3, part_doublons=0.05, part_hors_filtre=0.2) :
+    '''Génère un réseau fait de petits arbres répartis sur une emprise qui
+    grandit avec le nombre de sommets (densité de canalisation constante,
+    comme une commune plus grande et non un quartier plus chargé). Dans un
+    arbre, la canalisation j part de la fin de la canalisation
+    (j - 1) // branches et suit un cap tiré au hasard, avec de légers
+    virages ; les arbres partent des cases d'une grille, à une position
+    tirée dans la case. Un regard est posé sur chaque noeud, des points topo
+    sur une partie des sommets (bruit gaussien d'écart type bruit), avec des
+    doublons (deux points pour le même sommet) et des points hors filtre
+    Entrées : nb_sommets = taille visée (nombre total de sommets),
+    graine = graine du tirage, sommets_par_cana = sommets de chaque ligne,
+    pas = longueur moyenne d'un segment, canas_par_arbre = canalisations de
+    chaque arbre, densite = longueur de canalisation par unité de surface
+    (m/m²), part_* = proportions de points topo (par rapport aux sommets),
+    de doublons et de points hors filtre (par rapport aux points topo)
+    Sortie  : dictionnaire de tableaux numpy'''
+    rng = np.random.default_rng(graine)
+    s   = max(int(sommets_par_cana), 2)
+    n   = max(int(nb_sommets) // s, 1)
+    a   = max(int(canas_par_arbre), 1)
+
+    #Forme de chaque canalisation, à partir de son premier sommet
+    caps      = rng.uniform(0, 2 * np.pi, n)
+    angles    = caps[:, None] + np.cumsum(rng.normal(0, 0.15, (n, s - 1)),
+                                          axis=1)
+    longueurs = rng.uniform(0.5, 1.5, (n, s - 1)) * pas
+    segments  = np.stack([np.cos(angles), np.sin(angles)], axis=-1) \
+                * longueurs[..., None]
+    formes    = np.concatenate([np.zeros((n, 1, 2)),
+                                np.cumsum(segments, axis=1)], axis=1)
+
+    #Racines des arbres : une par case d'une grille dont la surface totale
+    #donne la densité voulue
+    nb_arbres = -(-n // a)
+    cotes     = int(np.ceil(np.sqrt(nb_arbres)))
+    case      = np.sqrt(longueurs.sum() / densite / nb_arbres)
+    rangees   = np.arange(nb_arbres)
+    racines   = (np.column_stack([rangees % cotes, rangees // cotes])
+                 + rng.uniform(0, 1, (nb_arbres, 2))) * case
+
+    #Premier sommet : racine de l'arbre ou fin de la canalisation parente,
+    #niveau par niveau (les enfants d'un niveau se suivent dans l'arbre)
+    locaux    = np.arange(n) % a
+    parents   = np.arange(n) - locaux + (locaux - 1) // branches
+    departs   = racines[np.arange(n) // a]
+    niveaux   = np.zeros(n, dtype=np.int64)
+    debut, fin = 0, 1
+    while debut * branches + 1 < a :
+        enfants = np.flatnonzero((locaux >= debut * branches + 1)
+                                 & (locaux < fin * branches + 1))
+        departs[enfants] = departs[parents[enfants]] \
+                           + formes[parents[enfants], -1]
+        niveaux[enfants] = niveaux[parents[enfants]] + 1
+        debut, fin = debut * branches + 1, fin * branches + 1
+    sommets   = departs[:, None, :] + formes
+
+    #Regards : le départ de chaque arbre (exutoire, le plus bas) et la fin
+    #de chaque canalisation
+    depart    = locaux == 0
+    regards   = np.concatenate([departs[depart], sommets[:, -1]])
+    z_regards = 50.0 + 0.5 * np.concatenate([np.zeros(depart.sum()),
+                                             niveaux + 1]) \
+                + rng.uniform(0, 0.2, len(regards))
+
+    #Points topo : sommets tirés et bruités, doublons, points hors filtre
+    xy        = sommets.reshape(-1, 2)
+    choisis   = rng.choice(len(xy), int(part_topo * len(xy)), replace=False)
+    doubles   = rng.choice(choisis, int(part_doublons * len(choisis)))
+    pertinents = np.concatenate([xy[choisis], xy[doubles]])
+    pertinents = pertinents + rng.normal(0, bruit, pertinents.shape)
+    nb_exclus = int(part_hors_filtre * len(choisis))
+    exclus    = rng.uniform(xy.min(axis=0), xy.max(axis=0), (nb_exclus, 2))
+    topo      = np.concatenate([pertinents, exclus])
+    codes     = np.concatenate([rng.choice(CODES, len(pertinents)),
+                                np.full(nb_exclus, CODE_EXCLU)])
+    melange   = rng.permutation(len(topo))
+
+    return {'sommets_par_cana' : s,
+            'sommets'          : xy,
+            'origines'         : sommets[:, 0],
+            'extremites'       : sommets[:, -1],
+            'regards'          : regards,
+            'z_regards'        : z_regards,
+            'topo'             : np.column_stack([topo[melange],
+                                     rng.uniform(40, 60, len(topo))]),
+            'codes'            : codes[melange]}
+
+def mesurer(fonction, *arguments, memoire=True) :
+    '''Lance fonction(*arguments) en mesurant sa durée, puis (memoire =
+    True) la relance sous tracemalloc pour le pic des allocations faites
+    pendant l'appel : tracemalloc ralentit beaucoup les allocations, la
+    durée est donc prise sans lui. fonction ne doit pas modifier ses
+    arguments (les deux passages doivent faire le même travail)
+    Sortie  : résultat du premier passage, durée (s), pic mémoire (octets,
+    None si memoire = False)'''
+    debut    = time.perf_counter()
+    resultat = fonction(*arguments)
+    duree    = time.perf_counter() - debut
+    pic      = None
+    if memoire :                                        #Passage séparé
+        tracemalloc.start()
+        fonction(*arguments)
+        _, pic = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return resultat, duree, pic
+
+def ligne_mesure(taille, etape, entrees, sorties, duree, pic) :
+    '''Une ligne du rapport'''
+    return {'taille'  : int(taille),
+            'etape'   : etape,
+            'entrees' : int(entrees),
+            'sorties' : int(sorties),
+            'duree_s' : round(duree, 6),
+            'debit'   : round(entrees / duree, 1) if duree > 0 else None,
+            'pic_mo'  : None if pic is None else round(pic / 2 ** 20, 2)}
+
+def etapes_moteurs(reseau, taille, k=4, methode='glouton', distance_max=None,
+                   memoire=True) :
+    '''Mesure les moteurs numpy/scipy (sans Qgis) : filtre compilé, index et
+    accrochage des sommets, affectation, contrôle des déplacements, 
+    projection sur les segments (si shapely est là), graphe du réseau, 
+    grille des regards. memoire = False pour ne pas mesurer le pic mémoire
+    (voir mesurer)
+    Sortie  : lignes du rapport'''
+    mesures  = []
+    topo     = reseau['topo']
+
+    predicat = moteur.compiler_filtre(FILTRE)
+    masque, duree, pic = mesurer(predicat, {'Profondeur' : reseau['codes']},
+                                 memoire=memoire)
+    mesures.append(ligne_mesure(taille, 'filtre_compile', len(topo),
+                                masque.sum(), duree, pic))
+    xy_topo  = topo[masque, :2]
+
+    index, duree, pic = mesurer(moteur.indexer_sommets, reseau['sommets'],
+                                memoire=memoire)
+    mesures.append(ligne_mesure(taille, 'indexer_sommets',
+                                len(reseau['sommets']), index.n, duree, pic))
+
+    (distances, indices), duree, pic = mesurer(moteur.accrocher_points, index,
+                                               xy_topo, k, distance_max,
+                                               memoire=memoire)
+    mesures.append(ligne_mesure(taille, 'accrocher_points', len(xy_topo),
+                                (indices[:, 0] >= 0).sum(), duree, pic))
+
+    choix, duree, pic = mesurer(moteur.affecter_points, distances, indices,
+                                methode, memoire=memoire)
+    mesures.append(ligne_mesure(taille, 'affecter_points', len(xy_topo),
+                                (choix >= 0).sum(), duree, pic))
+
+    s       = reseau['sommets_par_cana']
+    rang    = np.arange(len(reseau['sommets']))
+    magasin = moteur.magasin_sommets(
+        rang // s, rang % s,
+        np.column_stack([reseau['sommets'], np.full(len(rang), np.nan)]))
+    apres   = magasin.copy()                            #Recalé, hors mesure
+    attribution, _ = moteur.attribuer_sommets(choix, len(apres))
+    moteur.substituer_sommets(apres, attribution, np.column_stack(
+        [xy_topo, np.zeros(len(xy_topo))]))
+
+    def controle() :
+        _, bilan = moteur.controler_deplacements(magasin, apres)
+        return moteur.signaler_lignes(bilan, 1.0, 0.1)[0]
+    signales, duree, pic = mesurer(controle, memoire=memoire)
+    mesures.append(ligne_mesure(taille, 'controler_deplacements', len(apres),
+                                signales.sum(), duree, pic))
+
+    if moteur.shapely is not None :                     #Mode segments
+        xyz     = np.column_stack([xy_topo, np.full(len(xy_topo), np.nan)])
+
+        def segments() :                                #Copie : le magasin
+            return moteur.recaler_segments(             #est modifié sur place
+                magasin.copy(), xyz, distance_max)
+        resultat, duree, pic = mesurer(segments, memoire=memoire)
+        mesures.append(ligne_mesure(taille, 'recaler_segments', len(xy_topo),
+                                    resultat[1] + resultat[2], duree, pic))
+
+    graphe, duree, pic = mesurer(graphe_reseau.construire_graphe,
+                                 reseau['origines'], reseau['extremites'],
+                                 memoire=memoire)
+    mesures.append(ligne_mesure(taille, 'construire_graphe',
+                                len(reseau['origines']),
+                                len(graphe['noeuds']), duree, pic))
+
+    def grille_regards() :
+        grille = index_spatial.construire_grille(reseau['regards'], 1.0)
+        return index_spatial.plus_proche_grille(grille, np.concatenate(
+            [reseau['origines'], reseau['extremites']]), 0.01)
+    (trouves, _), duree, pic = mesurer(grille_regards, memoire=memoire)
+    mesures.append(ligne_mesure(taille, 'plus_proche_grille', len(trouves),
+                                (trouves >= 0).sum(), duree, pic))
+    return mesures
+
+def couche_memoire(nom, champs, type_geometrie, crs, geometries, attributs) :
+    '''Couche temporaire remplie en une seule écriture
+    Entrées : champs = liste de (nom, type QVariant), geometries et
+    attributs = listes de même longueur'''
+    from qgis.core import (QgsFeature, QgsField, QgsFields,
+                           QgsMemoryProviderUtils)
+    definition = QgsFields()
+    for nom_champ, type_champ in champs :
+        definition.append(QgsField(nom_champ, type_champ))
+    couche = QgsMemoryProviderUtils.createMemoryLayer(nom, definition,
+                                                      type_geometrie, crs)
+    entites = []
+    for geometrie, valeurs in zip(geometries, attributs) :
+        entite = QgsFeature(definition)
+        entite.setGeometry(geometrie)
+        entite.setAttributes(valeurs)
+        entites.append(entite)
+    couche.dataProvider().addFeatures(entites)
+    couche.updateExtents()
+    return couche
+
+def couches_qgis(reseau, code_crs='EPSG:2154') :
+    '''Couches temporaires du réseau synthétique : AEP_CANA (OBJECTID), TOPO
+    (X, Y, Z, Profondeur) et REGARDS (NUM_REG, Z_RELEVE, PROFONDEUR, CLASSE)
+    Sortie  : canalisations, points topo, regards'''
+    from qgis.core import (QgsCoordinateReferenceSystem, QgsGeometry,
+                           QgsLineString, QgsPoint, QgsWkbTypes)
+    from qgis.PyQt.QtCore import QVariant
+    crs    = QgsCoordinateReferenceSystem(code_crs)
+    lignes = reseau['sommets'].reshape(-1, reseau['sommets_par_cana'], 2)
+
+    cana   = couche_memoire(
+        'AEP_CANA', [('OBJECTID', QVariant.Int)], QgsWkbTypes.LineString, crs,
+        (QgsGeometry(QgsLineString(l[:, 0].tolist(), l[:, 1].tolist()))
+         for l in lignes),
+        ([rang + 1] for rang in range(len(lignes))))
+
+    topo   = couche_memoire(
+        'TOPO', [('X', QVariant.Double), ('Y', QVariant.Double),
+                 ('Z', QVariant.Double), ('Profondeur', QVariant.String)],
+        QgsWkbTypes.Point, crs,
+        (QgsGeometry(QgsPoint(x, y)) for x, y, _ in reseau['topo'].tolist()),
+        ([x, y, z, code] for (x, y, z), code
+         in zip(reseau['topo'].tolist(), reseau['codes'].tolist())))
+
+    rega   = couche_memoire(
+        'REGARDS', [('NUM_REG', QVariant.String), ('Z_RELEVE', QVariant.Double),
+                    ('PROFONDEUR', QVariant.Double),
+                    ('CLASSE', QVariant.String)],
+        QgsWkbTypes.Point, crs,
+        (QgsGeometry(QgsPoint(x, y)) for x, y in reseau['regards'].tolist()),
+        (['R' + str(rang + 1), z, 1.2, 'A']
+         for rang, z in enumerate(reseau['z_regards'].tolist())))
+    return cana, topo, rega
+
+def etapes_qgis(reseau, taille, k=4, methode='glouton', distance_max=None,
+                memoire=True) :
+    '''Mesure les étapes des deux scripts sur les couches du réseau
+    synthétique : extraire_sommets, topo_pertinente, jointure_proche_sommet,
+    separer_doublons, points_vers_lignes (recalage, enchaînement historique),
+    canalisations_jointes (amont/aval historique, branches l'une après
+    l'autre puis en même temps), puis les traitements en une passe
+    pipeline_recalage et canalisations_une_passe pour comparaison.
+    memoire : voir etapes_moteurs
+    Sortie  : lignes du rapport'''
+    import PY3_AEP_RECALAGE_CANA_V2         as recalage
+    import PY3_CREATION_POINT_AMONT_AVAL_V4 as amont_aval
+    from   qgis.PyQt.QtCore import QVariant
+    mesures = []
+    cana, topo, rega = couches_qgis(reseau)
+
+    def noter(etape, entree, fonction, *arguments) :
+        resultat, duree, pic = mesurer(fonction, *arguments, memoire=memoire)
+        sortie = resultat[0] if isinstance(resultat, tuple) else resultat
+        mesures.append(ligne_mesure(taille, etape, entree.featureCount(),
+                                    sortie.featureCount(), duree, pic))
+        return resultat
+
+    #Recalage : enchaînement historique, étape par étape
+    sommets  = noter('extraire_sommets', cana, recalage.extraire_sommets, cana)
+    recalage.creation_champ(sommets, 'UI', QVariant.Int)   #Hors mesure
+    recalage.identifiant_unique(sommets, 'UI')
+    filtres  = noter('topo_pertinente', topo, recalage.topo_pertinente, topo,
+                     FILTRE)
+    jointure = noter('jointure_proche_sommet', filtres,
+                     recalage.jointure_proche_sommet, filtres, sommets,
+                     distance_max, k, methode)
+    noter('separer_doublons', jointure, recalage.separer_doublons, jointure,
+          'UI')
+    noter('points_vers_lignes', sommets, recalage.points_vers_lignes, sommets,
+          'OBJECTID')
+
+    #Amont/aval historique (la fonction renomme les champs de la liste reçue :
+    #une liste neuve à chaque passage), branches l'une après l'autre puis en
+    #même temps
+    for nom, paralleles in (('canalisations_jointes', False), 
+                            ('canalisations_jointes_paralleles', True)) : 
+        noter(nom, cana, lambda paralleles=paralleles : 
+              amont_aval.canalisations_jointes(cana, rega, 
+                                               list(CHAMPS_REGARDS), 
+                                               'OBJECTID', 0, None, 
+                                               paralleles))
+
+    #Traitements en une passe
+    noter('pipeline_recalage', cana, recalage.pipeline_recalage, cana, topo,
+          'OBJECTID', FILTRE, distance_max, k, methode)
+    noter('canalisations_une_passe', cana, amont_aval.canalisations_une_passe,
+          cana, rega, list(CHAMPS_REGARDS), 0, 'OBJECTID')
+    return mesures
+
+def meilleures(mesures) :
+    '''Garde, pour chaque taille et chaque étape, la répétition la plus
+    rapide (dans l'ordre de première apparition)'''
+    retenues = {}
+    for mesure in mesures :
+        cle = (mesure['taille'], mesure['etape'])
+        if cle not in retenues or mesure['duree_s'] < retenues[cle]['duree_s'] :
+            retenues[cle] = mesure
+    return list(retenues.values())
+
+def afficher(mesures) :
+    '''Affiche le rapport sous forme de tableau'''
+    colonnes = ['taille', 'etape', 'entrees', 'sorties', 'duree_s', 'debit',
+                'pic_mo']
+    lignes   = [colonnes] + [[str(m[c]) for c in colonnes] for m in mesures]
+    largeurs = [max(len(ligne[i]) for ligne in lignes)
+                for i in range(len(colonnes))]
+    for ligne in lignes :
+        print('  '.join(valeur.rjust(largeur) if rang != 1 else
+                        valeur.ljust(largeur) for rang, (valeur, largeur)
+                        in enumerate(zip(ligne, largeurs))))
+
+def enregistrer(mesures, chemin) :
+    '''Écrit le rapport en .json (liste d'objets) ou en .csv (séparateur ;)'''
+    if chemin.lower().endswith('.json') :
+        with open(chemin, 'w', encoding='utf-8') as fichier :
+            json.dump(mesures, fichier, indent=1)
+        return
+    with open(chemin, 'w', newline='', encoding='utf-8') as fichier :
+        ecrivain = csv.DictWriter(fichier, fieldnames=list(mesures[0]),
+                                  delimiter=';')
+        ecrivain.writeheader()
+        ecrivain.writerows(mesures)
+
+def lire_arguments(arguments=None) :
+    '''Lit les arguments de la ligne de commande'''
+    analyseur = argparse.ArgumentParser(
+        description="Banc d'essai du recalage et de l'amont/aval")
+    analyseur.add_argument('--tailles', type=int, nargs='+',
+                           default=[10000, 100000, 1000000],
+                           help="nombres de sommets des réseaux générés")
+    analyseur.add_argument('--graine', type=int, default=0)
+    analyseur.add_argument('--sommets-par-cana', type=int, default=10)
+    analyseur.add_argument('--bruit', type=float, default=0.2,
+                           help="écart type du bruit des points topo")
+    analyseur.add_argument('--part-topo', type=float, default=0.3)
+    analyseur.add_argument('--doublons', type=float, default=0.05,
+                           help="part des points topo en double")
+    analyseur.add_argument('--hors-filtre', type=float, default=0.2,
+                           help="part des points topo rejetés par le filtre")
+    analyseur.add_argument('--k-voisins', type=int, default=4)
+    analyseur.add_argument('--methode', default='glouton',
+                           choices=['glouton', 'hongrois'])
+    analyseur.add_argument('--distance-max', type=float)
+    analyseur.add_argument('--repetitions', type=int, default=1,
+                           help="lancements par taille (le plus rapide est "
+                                "gardé)")
+    analyseur.add_argument('--sans-memoire', action='store_true',
+                           help="pas de passage sous tracemalloc pour le pic "
+                                "mémoire (banc d'essai deux fois plus court)")
+    analyseur.add_argument('--densite', type=float, default=0.02,
+                           help="longueur de canalisation par m² (emprise "
+                                "du réseau proportionnelle à sa taille)")
+    analyseur.add_argument('--sans-qgis', action='store_true',
+                           help="moteurs numpy/scipy seulement")
+    analyseur.add_argument('--prefixe-qgis', default=os.environ.get(
+                           'QGIS_PREFIX_PATH'))
+    analyseur.add_argument('--sortie', help="rapport .csv ou .json")
+    return analyseur.parse_args(arguments)
+
+def main(arguments=None) :
+    '''Génère les réseaux, mesure chaque étape et rend le rapport
+    Sortie : code de retour (0 = réussite)'''
+    arguments   = lire_arguments(arguments)
+    application = None
+    if not arguments.sans_qgis :                        #Qgis avec processing
+        import PY3_LIGNE_COMMANDE_V1 as ligne_commande
+        application = ligne_commande.demarrer_qgis(arguments.prefixe_qgis,
+                                                   True)
+    mesures = []
+    try :
+        for taille in arguments.tailles :
+            reseau = generer_reseau(taille, arguments.graine,
+                                    arguments.sommets_par_cana,
+                                    densite=arguments.densite,
+                                    bruit=arguments.bruit,
+                                    part_topo=arguments.part_topo,
+                                    part_doublons=arguments.doublons,
+                                    part_hors_filtre=arguments.hors_filtre)
+            for _ in range(max(arguments.repetitions, 1)) :
+                mesures += etapes_moteurs(reseau, taille, arguments.k_voisins,
+                                          arguments.methode,
+                                          arguments.distance_max,
+                                          not arguments.sans_memoire)
+                if application is not None :
+                    mesures += etapes_qgis(reseau, taille, arguments.k_voisins,
+                                           arguments.methode,
+                                           arguments.distance_max,
+                                           not arguments.sans_memoire)
+    finally :
+        if application is not None :
+            application.exitQgis()
+
+    mesures = meilleures(mesures)
+    afficher(mesures)
+    if arguments.sortie :
+        enregistrer(mesures, arguments.sortie)
+    return 0
+
+#_______________________________________________________________________________
+
+####                             SCRIPT PRINCIPAL                           ####
+
+if __name__ == '__main__' :
+    sys.exit(main())
@@ -32,6 +32,15 @@ canalisation   = "CANALISATIONS"
 regard         = "REGARDS"
 champs         = ["NUM_REG", "Z_RELEVE", "PROFONDEUR", "CLASSE"]
 ID_unique_cana = "num_tron"
+mode_une_passe = True
+branches_paralleles = False
+tolerance      = 0.0
+champ_altitude = None
+fichier_rapport = ""
+mesure_memoire  = False
+dossier_index    = ""
+taille_max_index = 500
+dossier_scripts = ""
 
 #AIDE : 
 
@@ -40,6 +49,35 @@ ID_unique_cana = "num_tron"
 #     - champs est l'ensemble des champs issus de la couche  des regards à 
 #       retrouver dans le résultat
 #     - ID_unique_cana est l'identifiant unique de la couche de canalisations
+#     - mode_une_passe = True pour lire les extrémités de chaque canalisation 
+#       en une seule passe et les chercher dans un index des regards construit
+#       une fois ; False pour l'enchaînement historique des traitements
+#     - branches_paralleles = True pour traiter en même temps l'amont et l'aval
+#       dans l'enchaînement historique (extraction des sommets puis jointure
+#       aux regards), False pour les traiter l'un après l'autre. Le gain n'est
+#       pas mesuré et l'aval travaille sur des copies des couches : à 
+#       comparer sur ses données avant de l'activer (banc d'essai)
+#     - tolerance est la distance (unités de la couche) en dessous de laquelle
+#       une extrémité de canalisation est raccordée au regard le plus proche.
+#       0 = coordonnées strictement identiques
+#     - champ_altitude est le champ des regards donnant l'altitude (ex : 
+#       "Z_RELEVE"). S'il est renseigné, l'amont et l'aval sont tirés du graphe
+#       du réseau (sens d'écoulement du plus haut vers le plus bas, puis vers 
+#       l'exutoire de chaque partie du réseau) au lieu de l'ordre des sommets :
+#       les canalisations dessinées à contre-sens sont retournées et signalées
+#       dans le champ SENS_INVERSE. None = ordre des sommets
+#     - fichier_rapport est le chemin d'un fichier .json ou .csv où écrire la
+#       durée et les effectifs de chaque étape et les comptages de contrôle.
+#       Laisser vide pour ne pas l'écrire. mesure_memoire = True y ajoute le
+#       pic mémoire de chaque étape (traitement plus lent : diagnostic)
+#     - dossier_index est un dossier où garder l'index des regards (mode une
+#       passe) d'un lancement à l'autre : il est relu tant que le fichier des
+#       regards, son système de coordonnées, les champs et la tolérance n'ont
+#       pas changé. Laisser vide pour le reconstruire à chaque fois. Les
+#       index les moins récemment utilisés sont effacés au-delà de 
+#       taille_max_index (Mo)
+#     - dossier_scripts est le dossier contenant ce script et ses modules
+#       (PY3_INDEX_SPATIAL_V1.py...). Laisser vide s'il est trouvé tout seul
 
 #       Tous les noms doivent être entre guillemets
 #       Il faut bien mettre la liste des champs entre crochet, séparés par des
@@ -51,8 +89,25 @@ ID_unique_cana = "num_tron"
 ####                             PARTIE FONCTIONS                           ####
 
 #Imports de modules
+import os
+import sys
+import numpy as np
 import processing
-from qgis.core import QgsProject
+from qgis.core import (QgsProject, QgsFeature, QgsField, QgsFields,
+                       QgsGeometry, QgsMemoryProviderUtils, QgsPoint,
+                       QgsProcessing, QgsWkbTypes)
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import NULL
+
+#Accès aux modules rangés avec ce script
+if not dossier_scripts and '__file__' in globals() : 
+    dossier_scripts = os.path.dirname(os.path.abspath(__file__))
+if dossier_scripts and dossier_scripts not in sys.path : 
+    sys.path.append(dossier_scripts)
+import PY3_GRAPHE_RESEAU_V1   as graphe_reseau
+import PY3_INDEX_SPATIAL_V1   as index_spatial
+import PY3_INSTRUMENTATION_V1 as instrumentation
+import PY3_ORDONNANCEUR_V1    as ordonnanceur
 
 
 def extraire_sommets(couche, ind) : 
@@ -69,9 +124,13 @@ def extraire_sommets(couche, ind) :
                             
     return points['OUTPUT']
 
-def jointure_regards(regards, extremites, champs) : 
+def jointure_regards(regards, extremites, champs, tolerance=0) : 
     '''Joint la couche des regards avec une couche de points en entrée
+    Avec une tolérance, chaque point prend le regard le plus proche à moins de
+    tolerance (index en grille) au lieu d'exiger des coordonnées identiques
     Sortie : Couche temporaire'''
+    if tolerance > 0 : 
+        return jointure_tolerance(regards, extremites, champs, tolerance)
     jointure = processing.run('qgis:joinattributesbylocation', 
                               {'INPUT'       : regards,
                                'JOIN'        : extremites, 
@@ -101,24 +160,74 @@ def jointure_attributaire(cana, point, champ_jointure, champs_joints, prefixe) :
                               })
     return jointure['OUTPUT']
 
-def extremites(cana, rega, champs) : 
+def jointure_tolerance(points, rega, champs, tolerance) : 
+    '''Jointure des champs du regard le plus proche (à moins de tolerance) sur
+    chaque point, mêmes champs en sortie que jointure_regards ('_' + champ)
+    Sortie : Couche temporaire'''
+    grille, valeurs = indexer_regards(rega, champs, tolerance)
+    entites = [f for f in points.getFeatures() if f.hasGeometry()]
+    xy      = np.array([(p.x(), p.y()) for p in 
+                        (f.geometry().vertexAt(0) for f in entites)], 
+                       dtype=np.float64).reshape(-1, 2)
+    trouves, _ = index_spatial.plus_proche_grille(grille, xy, tolerance)
+    
+    sortie  = QgsFields(points.fields())
+    for champ in champs : 
+        nouveau = QgsField(rega.fields().field(champ))
+        nouveau.setName('_' + champ)
+        sortie.append(nouveau)
+    jointure = QgsMemoryProviderUtils.createMemoryLayer(
+        'Couche issue de la jointure spatiale', sortie, points.wkbType(), 
+        points.crs())
+    
+    vide    = [None] * len(champs)
+    resultat = []
+    for feature, trouve in zip(entites, trouves) : 
+        entite = QgsFeature(sortie)
+        entite.setGeometry(feature.geometry())
+        entite.setAttributes(feature.attributes() 
+                             + (valeurs[trouve] if trouve >= 0 else vide))
+        resultat.append(entite)
+    jointure.dataProvider().addFeatures(resultat)
+    jointure.updateExtents()
+    
+    return jointure
+
+def extremite_jointe(cana, ind, rega, champs, tolerance=0) : 
+    '''Branche amont (ind = -1) ou aval (ind = 0) : extraction des sommets 
+    puis jointure avec les regards
+    Sortie : Couche temporaire'''
+    points = extraire_sommets(cana, ind)
+    return jointure_regards(points, rega, champs, tolerance)
+
+def extremites(cana, rega, champs, tolerance=0, paralleles=False) : 
     '''Sort les sommets amonts et aval d'une couche et les ajoute au projet
+    Les deux branches sont indépendantes : avec paralleles, elles tournent en
+    même temps (voir PY3_ORDONNANCEUR_V1.py)
     sortie : liste de couches temporaires'''
-    #Extraction des sommets
-    point_amont = extraire_sommets(cana, -1)
-    point_aval  = extraire_sommets(cana,  0)
-    
-    #Jointure avec les regards
-    amont = jointure_regards( point_amont, rega, champs)
-    aval  = jointure_regards( point_aval,  rega, champs)
+    #Extraction des sommets et jointure avec les regards. L'amont tourne dans
+    #le fil courant sur les couches d'origine, l'aval sur des copies faites
+    #ici (fil principal)
+    copie    = ordonnanceur.copie_pour_branche
+    branches = ordonnanceur.executer(
+        {'amont' : (extremite_jointe, cana, -1, rega, champs, tolerance), 
+         'aval'  : (extremite_jointe, copie(cana, paralleles),  0, 
+                    copie(rega, paralleles), champs, tolerance)}, 
+        paralleles, ordonnanceur.rendre_au_fil_principal)
 
-    return amont, aval
+    return branches['amont'], branches['aval']
 
-def canalisations_jointes(cana, rega, champs, ID_unique_cana) :
-    '''Jointure des champs utiles dans les canalisations'''
+def canalisations_jointes(cana, rega, champs, ID_unique_cana, tolerance=0, 
+                          suivi=None, paralleles=False) :
+    '''Jointure des champs utiles dans les canalisations
+    suivi = mesure des étapes (voir PY3_INSTRUMENTATION_V1.py, None = pas de
+    mesure), paralleles = amont et aval en même temps (voir extremites)'''
     #Mise en route de la fonction extremites et stokage du résultat dans la 
     #variable 'points'
-    points = extremites(cana, rega, champs)
+    with instrumentation.etape(suivi, 'extremites', 
+                               cana.featureCount()) as mesure : 
+        points = extremites(cana, rega, champs, tolerance, paralleles)
+        mesure['sorties'] = points[0].featureCount() + points[1].featureCount()
 
     #Renommage des champs avec le préfixe de la jointure par localisation entre 
     #les points amont-aval et les regards
@@ -126,30 +235,283 @@ def canalisations_jointes(cana, rega, champs, ID_unique_cana) :
         champs[i] = '_' + champs[i]
 
     #Jointure attributaire entre la couche de canalisation et les points amont 
-    cana_step_1 = jointure_attributaire(cana      , points[1], ID_unique_cana,
-                                        champs, 'AM')
+    with instrumentation.etape(suivi, 'jointure_amont', 
+                               cana.featureCount()) as mesure : 
+        cana_step_1 = jointure_attributaire(cana      , points[1], 
+                                            ID_unique_cana, champs, 'AM')
+        mesure['sorties'] = cana_step_1.featureCount()
     
     #Jointure attributaire entre la couche de canalisation et les points amont 
-    cana_step_2  = jointure_attributaire(cana_step_1, points[0], ID_unique_cana,
-                                         champs, 'AV')
+    with instrumentation.etape(suivi, 'jointure_aval', 
+                               cana_step_1.featureCount()) as mesure : 
+        cana_step_2  = jointure_attributaire(cana_step_1, points[0], 
+                                             ID_unique_cana, champs, 'AV')
+        mesure['sorties'] = cana_step_2.featureCount()
                                         
     #Renommage de la couche (nom de couche par défaut = 'Couche issue de la 
     #jointure spatiale')
     cana_step_2.setName('RESULTAT_CANALISATIONS')
+    instrumentation.compter(suivi, 'canalisations_source', cana.featureCount())
+    instrumentation.compter(suivi, 'canalisations_resultat', 
+                            cana_step_2.featureCount())
     
     return cana_step_2
 
+def indexer_regards(rega, champs, tolerance=0, dossier_index=None, 
+                    taille_max_index=None) : 
+    '''Construit une seule fois l'index en grille des regards, avec des 
+    cellules de la taille de la tolérance. Avec dossier_index, l'index et les
+    valeurs sont relus sur disque s'ils y sont déjà pour ce fichier de regards
+    (voir PY3_INDEX_SPATIAL_V1.py), sinon construits puis gardés
+    Sortie : grille des regards, valeurs des champs de chaque regard. Si 
+    plusieurs regards sont à la même distance, le premier est gardé (comme la
+    jointure par localisation en mode 'premier')'''
+    cle = None
+    if dossier_index : 
+        cle   = index_spatial.cle_couche(rega, dossier_index, 'regards', 
+                                         champs, tolerance)
+        garde = index_spatial.lire_cache(dossier_index, cle)
+        if garde is not None : 
+            valeurs = garde.pop('valeurs')
+            return garde, valeurs
+    
+    index_champs = [rega.fields().lookupField(champ) for champ in champs]
+    xy           = []
+    valeurs      = []
+    for feature in rega.getFeatures() : 
+        if not feature.hasGeometry() : 
+            continue
+        point = feature.geometry().vertexAt(0)
+        xy.append((point.x(), point.y()))
+        valeurs.append([feature.attribute(i) for i in index_champs])
+    
+    taille = tolerance if tolerance > 0 else 1.0        #0 = égalité stricte
+    grille = index_spatial.construire_grille(
+        np.array(xy, dtype=np.float64).reshape(-1, 2), taille)
+    if cle is not None :                                #NULL non picklable
+        valeurs = [[None if v == NULL else v for v in ligne] 
+                   for ligne in valeurs]
+        index_spatial.ecrire_cache(dossier_index, cle, 
+                                   dict(grille, valeurs=valeurs), 
+                                   taille_max_index)
+    return grille, valeurs
+
+def extremites_une_passe(geometrie) : 
+    '''Premier et dernier sommet d'une géométrie linéaire'''
+    dernier = geometrie.constGet().nCoordinates() - 1
+    return geometrie.vertexAt(0), geometrie.vertexAt(dernier)
+
+def inverser_geometrie(geometrie) : 
+    '''Géométrie linéaire parcourue dans l'autre sens. Pour une multiligne 
+    (couches Shapefile...), chaque partie est retournée et l'ordre des 
+    parties aussi : le premier sommet devient le dernier'''
+    ligne = geometrie.constGet()
+    if not QgsWkbTypes.isMultiType(ligne.wkbType()) : 
+        return QgsGeometry(ligne.reversed())
+    inverse = ligne.createEmptyWithSameType()
+    for rang in reversed(range(ligne.numGeometries())) : 
+        inverse.addGeometry(ligne.geometryN(rang).reversed())
+    return QgsGeometry(inverse)
+
+def couche_non_raccordees(cana, id_cana, entites, xy, non_trouves, distances,
+                          inverser=None) :
+    '''Rapport des extrémités sans regard dans la tolérance, avec la distance
+    au regard le plus proche. inverser = masque des canalisations dessinées à
+    contre-sens (voir sens_par_graphe) : leur premier sommet est l'aval
+    Sortie : couche temporaire EXTREMITES_NON_RACCORDEES'''
+    sortie = QgsFields()
+    if id_cana : 
+        sortie.append(QgsField(cana.fields().field(id_cana)))
+    sortie.append(QgsField('EXTREMITE', QVariant.String))
+    sortie.append(QgsField('DISTANCE',  QVariant.Double))
+    rapport = QgsMemoryProviderUtils.createMemoryLayer(
+        'EXTREMITES_NON_RACCORDEES', sortie, QgsWkbTypes.Point, cana.crs())
+    
+    resultat = []
+    for rang, distance in zip(non_trouves, distances) : 
+        feature = entites[rang // 2]                    #2 extrémités par ligne
+        entite  = QgsFeature(sortie)
+        valeurs = [feature[id_cana]] if id_cana else []
+        premier = rang % 2 == 0                         #Premier sommet
+        if inverser is not None and inverser[rang // 2] : 
+            premier = not premier                       #Sens du graphe
+        valeurs.append('AM' if premier else 'AV')
+        valeurs.append(float(distance) if np.isfinite(distance) else None)
+        entite.setAttributes(valeurs)
+        entite.setGeometry(QgsGeometry(QgsPoint(*xy[rang])))
+        resultat.append(entite)
+    rapport.dataProvider().addFeatures(resultat)
+    rapport.updateExtents()
+    
+    return rapport
+
+def en_reel(valeur) : 
+    '''Valeur numérique d'un attribut (nan si vide ou non numérique)'''
+    try : 
+        return float(valeur)
+    except (TypeError, ValueError) : 
+        return np.nan
+
+def sens_par_graphe(xy, valides, altitudes, tolerance) : 
+    '''Sens d'écoulement tiré du graphe du réseau construit sur les extrémités
+    Entrées : xy = extrémités (premier, dernier sommet de chaque ligne à la 
+    suite), valides = extrémités connues, altitudes = altitude du regard 
+    raccordé à chaque extrémité (nan si aucun), tolerance
+    Sortie  : masque des canalisations dessinées à contre-sens'''
+    lignes   = np.flatnonzero(valides[0::2])            #Lignes avec géométrie
+    graphe   = graphe_reseau.construire_graphe(xy[2 * lignes], 
+                                               xy[2 * lignes + 1], tolerance)
+    
+    #Altitude de chaque noeud : celle d'un regard raccordé à une extrémité
+    noeuds   = np.concatenate([graphe['origine'], graphe['extremite']])
+    connues  = np.concatenate([altitudes[2 * lignes], 
+                               altitudes[2 * lignes + 1]])
+    alt      = np.full(len(graphe['noeuds']), np.nan)
+    garder   = ~np.isnan(connues)
+    alt[noeuds[garder]] = connues[garder]
+    
+    exutoires = graphe_reseau.exutoires_par_composante(graphe, alt)
+    inverser  = np.zeros(len(valides) // 2, dtype=bool)
+    inverser[lignes] = graphe_reseau.orienter(graphe, alt, exutoires)
+    return inverser
+
+def canalisations_une_passe(cana, rega, champs, tolerance=0, id_cana=None, 
+                            champ_altitude=None, suivi=None, 
+                            dossier_index=None, taille_max_index=None) : 
+    '''Jointure des champs utiles dans les canalisations en une seule passe : 
+    le premier et le dernier sommet de chaque canalisation sont cherchés en 
+    une requête groupée dans l'index en grille des regards (regard le plus 
+    proche à moins de tolerance) et les champs sont écrits directement dans 
+    l'entité de sortie (AM_ = premier sommet, AV_ = dernier sommet, comme 
+    canalisations_jointes). Avec champ_altitude, l'amont et l'aval viennent 
+    du graphe du réseau et les lignes à contre-sens sont retournées. 
+    suivi = mesure des étapes (None = pas de mesure), dossier_index et 
+    taille_max_index = index des regards gardé sur disque (voir 
+    indexer_regards)
+    Sortie : couche temporaire RESULTAT_CANALISATIONS, couche temporaire 
+    EXTREMITES_NON_RACCORDEES des extrémités sans regard'''
+    lus = champs + [champ_altitude] if champ_altitude else champs
+    with instrumentation.etape(suivi, 'indexer_regards', 
+                               rega.featureCount()) as mesure : 
+        grille, valeurs = indexer_regards(rega, lus, tolerance, dossier_index,
+                                          taille_max_index)
+        mesure['sorties'] = len(valeurs)
+    
+    #Une seule passe : extrémités de chaque canalisation
+    with instrumentation.etape(suivi, 'extremites', 
+                               cana.featureCount()) as mesure : 
+        entites = list(cana.getFeatures())
+        xy      = np.full((2 * len(entites), 2), np.nan)
+        for rang, feature in enumerate(entites) : 
+            if feature.hasGeometry() : 
+                amont, aval = extremites_une_passe(feature.geometry())
+                xy[2 * rang]     = (amont.x(), amont.y())
+                xy[2 * rang + 1] = (aval.x(),  aval.y())
+        valides = ~np.isnan(xy[:, 0])                   #Lignes sans géométrie
+        mesure['sorties'] = int(valides.sum())
+    with instrumentation.etape(suivi, 'jointure_regards', 
+                               int(valides.sum())) as mesure : 
+        trouves = np.full(len(xy), -1, dtype=np.int64)
+        trouves[valides], _ = index_spatial.plus_proche_grille(
+            grille, xy[valides], tolerance)
+        mesure['sorties'] = int((trouves >= 0).sum())
+    
+    #Sens d'écoulement : graphe du réseau ou ordre des sommets
+    inverser = np.zeros(len(entites), dtype=bool)
+    if champ_altitude : 
+        with instrumentation.etape(suivi, 'sens_par_graphe', 
+                                   len(entites)) as mesure : 
+            altitudes = np.array([en_reel(valeurs[t][-1]) if t >= 0 
+                                  else np.nan for t in trouves], 
+                                 dtype=np.float64)
+            inverser  = sens_par_graphe(xy, valides, altitudes, tolerance)
+            mesure['sorties'] = int(inverser.sum())
+        instrumentation.compter(suivi, 'canalisations_inversees', 
+                                inverser.sum())
+    
+    with instrumentation.etape(suivi, 'ecrire_resultat', 
+                               len(entites)) as mesure : 
+        #Champs de sortie : ceux des canalisations, puis AM_ et AV_
+        sortie  = QgsFields(cana.fields())
+        for prefixe in ('AM', 'AV') : 
+            for champ in champs : 
+                nouveau = QgsField(rega.fields().field(champ))
+                nouveau.setName(prefixe + '_' + champ)
+                sortie.append(nouveau)
+        if champ_altitude : 
+            sortie.append(QgsField('SENS_INVERSE', QVariant.Int))
+        resultat = QgsMemoryProviderUtils.createMemoryLayer(
+            'RESULTAT_CANALISATIONS', sortie, cana.wkbType(), cana.crs())
+
+        vide    = [None] * len(champs)
+        sorties = []
+        for rang, feature in enumerate(entites) : 
+            amont, aval = trouves[2 * rang], trouves[2 * rang + 1]
+            geometrie   = feature.geometry()
+            if inverser[rang] :                         #Dessinée à contre-sens
+                amont, aval = aval, amont
+                geometrie   = inverser_geometrie(geometrie)
+            attributs = (feature.attributes() 
+                         + (valeurs[amont][:len(champs)] if amont >= 0 
+                            else vide)
+                         + (valeurs[aval][:len(champs)]  if aval  >= 0 
+                            else vide))
+            if champ_altitude : 
+                attributs.append(int(inverser[rang]))
+            entite = QgsFeature(sortie)
+            entite.setGeometry(geometrie)
+            entite.setAttributes(attributs)
+            sorties.append(entite)
+        resultat.dataProvider().addFeatures(sorties)
+        resultat.updateExtents()
+        mesure['sorties'] = resultat.featureCount()
+    
+    #Rapport des extrémités non raccordées
+    non_trouves = np.flatnonzero((trouves < 0) & valides)
+    with instrumentation.etape(suivi, 'non_raccordees', 
+                               len(non_trouves)) as mesure : 
+        distances   = index_spatial.distance_plus_proche(grille['xy'], 
+                                                         xy[non_trouves])
+        non_raccordees = couche_non_raccordees(cana, id_cana, entites, xy, 
+                                               non_trouves, distances, 
+                                               inverser)
+        mesure['sorties'] = non_raccordees.featureCount()
+    
+    instrumentation.compter(suivi, 'canalisations_source',   len(entites))
+    instrumentation.compter(suivi, 'canalisations_resultat', 
+                            resultat.featureCount())
+    instrumentation.compter(suivi, 'extremites_non_raccordees', 
+                            len(non_trouves))
+    return resultat, non_raccordees
+
 #_______________________________________________________________________________
 
 ####                             SCRIPT PRINCIPAL                           ####
 
-#Récupération de la couche de nom contenu dans la variable canalisation et de la
-#couche de nom contenu dans la variable regard
-cana = QgsProject.instance().mapLayersByName(canalisation)[0]
-rega = QgsProject.instance().mapLayersByName(regard)[0]
+#Lancé depuis la console Python de Qgis (ou directement) : pas à l'import du
+#fichier comme module (ligne de commande PY3_LIGNE_COMMANDE_V1.py)
+if __name__ in ('__main__', '__console__') : 
+
+    #Récupération de la couche de nom contenu dans la variable canalisation et 
+    #de la couche de nom contenu dans la variable regard
+    cana = QgsProject.instance().mapLayersByName(canalisation)[0]
+    rega = QgsProject.instance().mapLayersByName(regard)[0]
 
-#Lancement de l'insertion des champs des regards amont et aval dans les canalis
-res_canalisations = canalisations_jointes(cana, rega, champs, ID_unique_cana)
+    #Lancement de l'insertion des champs des regards amont et aval dans les 
+    #canalisations, chaque étape mesurée
+    suivi = instrumentation.nouveau_suivi('amont_aval', mesure_memoire)
+    if mode_une_passe : 
+        res_canalisations, non_raccordees = canalisations_une_passe(
+            cana, rega, champs, tolerance, ID_unique_cana, champ_altitude, 
+            suivi, dossier_index, taille_max_index)
+        QgsProject.instance().addMapLayer(non_raccordees)
+    else : 
+        res_canalisations = canalisations_jointes(cana, rega, champs, 
+                                                  ID_unique_cana, tolerance, 
+                                                  suivi, branches_paralleles)
+    rapport = instrumentation.terminer(suivi)
+    if fichier_rapport :                            #Rapport des étapes
+        instrumentation.enregistrer_rapport(rapport, fichier_rapport)
 
-#Ajout des couches dans le projet
-QgsProject.instance().addMapLayer(res_canalisations)
+    #Ajout des couches dans le projet
+    QgsProject.instance().addMapLayer(res_canalisations)
@@ -0,0 +1,162 @@
+#! /urs/bin/env python3
+# coding: utf-8
+
+'''
+GRAPHE TOPOLOGIQUE D'UN RESEAU DE CANALISATIONS
+Date          : 17/10/2026
+Version       : 1
+Compatibilité : Qgis 3 (numpy et scipy fournis avec Qgis), utilisable hors Qgis
+But           : Construire une seule fois le graphe du réseau à partir des
+                extrémités des canalisations (noeuds accrochés entre eux dans
+                une tolérance), puis en tirer les composantes connexes, le
+                contrôle et la correction du sens d'écoulement et l'amont/aval
+                de chaque canalisation
+Utilisation   : Module importé par les scripts du dossier (doit se trouver dans
+                le même dossier qu'eux)
+Entrées       : Premier et dernier sommet de chaque canalisation (tableaux
+                (n, 2) X Y), altitudes des noeuds si elles sont connues
+Sorties       : graphe = dictionnaire de tableaux numpy :
+                - noeuds     : (k, 2) coordonnées des noeuds
+                - origine    : (n,) noeud du premier sommet de chaque ligne
+                - extremite  : (n,) noeud du dernier sommet de chaque ligne
+                - indptr, voisins, aretes : adjacence au format CSR (voisins
+                  et canalisations du noeud i entre indptr[i] et indptr[i+1])
+'''
+
+#_______________________________________________________________________________
+
+####                             PARTIE FONCTIONS                           ####
+
+#Imports de modules
+import numpy as np
+from   scipy.sparse         import coo_matrix, csr_matrix
+from   scipy.sparse.csgraph import connected_components, shortest_path
+from   scipy.spatial        import cKDTree
+
+
+def numeroter_noeuds(xy, tolerance=0) :
+    '''Donne un numéro de noeud à chaque extrémité : les extrémités à moins de
+    tolerance l'une de l'autre (de proche en proche) forment le même noeud
+    Entrées : xy = tableau (m, 2) des extrémités, tolerance = distance
+    d'accrochage (0 = coordonnées identiques)
+    Sortie  : numéro de noeud de chaque extrémité, coordonnées (moyennes) des
+    noeuds'''
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    if tolerance > 0 and len(xy) :
+        paires = cKDTree(xy).query_pairs(tolerance, output_type='ndarray')
+        liens  = coo_matrix((np.ones(len(paires)), (paires[:, 0],
+                             paires[:, 1])), shape=(len(xy), len(xy)))
+        _, numeros = connected_components(liens, directed=False)
+    else :
+        _, numeros = np.unique(xy, axis=0, return_inverse=True)
+        numeros    = numeros.ravel()
+    effectifs = np.bincount(numeros)
+    noeuds    = np.column_stack([np.bincount(numeros, xy[:, 0]),
+                                 np.bincount(numeros, xy[:, 1])])
+    return numeros.astype(np.int64), noeuds / effectifs[:, None]
+
+def construire_graphe(origines, extremites, tolerance=0) :
+    '''Construit le graphe du réseau : un noeud par groupe d'extrémités
+    accrochées, une arête par canalisation, adjacence stockée en CSR
+    Entrées : origines, extremites = tableaux (n, 2) du premier et du dernier
+    sommet de chaque canalisation, tolerance = distance d'accrochage
+    Sortie  : graphe (voir l'en-tête du module)'''
+    origines = np.asarray(origines, dtype=np.float64).reshape(-1, 2)
+    n        = len(origines)
+    numeros, noeuds = numeroter_noeuds(np.concatenate([origines,
+                                       np.asarray(extremites, np.float64)
+                                       .reshape(-1, 2)]), tolerance)
+    origine, extremite = numeros[:n], numeros[n:]
+
+    #Adjacence dans les deux sens, triée par noeud de départ
+    depart  = np.concatenate([origine, extremite])
+    arrivee = np.concatenate([extremite, origine])
+    aretes  = np.concatenate([np.arange(n), np.arange(n)])
+    ordre   = np.argsort(depart, kind='stable')
+    indptr  = np.zeros(len(noeuds) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(depart, minlength=len(noeuds)), out=indptr[1:])
+
+    return {'noeuds'    : noeuds,
+            'origine'   : origine,
+            'extremite' : extremite,
+            'indptr'    : indptr,
+            'voisins'   : arrivee[ordre],
+            'aretes'    : aretes[ordre]}
+
+def matrice(graphe) :
+    '''Matrice creuse (CSR) d'adjacence du graphe, sans recopie des tableaux'''
+    k = len(graphe['noeuds'])
+    return csr_matrix((np.ones(len(graphe['voisins'])), graphe['voisins'],
+                       graphe['indptr']), shape=(k, k))
+
+def degres(graphe) :
+    '''Nombre de canalisations qui touchent chaque noeud'''
+    return np.diff(graphe['indptr'])
+
+def composantes(graphe) :
+    '''Composantes connexes du réseau
+    Sortie : nombre de composantes, numéro de composante de chaque noeud'''
+    return connected_components(matrice(graphe), directed=False)
+
+def verifier_sens(graphe, altitudes) :
+    '''Contrôle le sens de numérisation par rapport aux altitudes des noeuds :
+    une canalisation dessinée vers le haut (premier sommet plus bas que le
+    dernier) est à contre-pente
+    Sortie : masque des canalisations à contre-pente (False si une des deux
+    altitudes est inconnue)'''
+    altitudes = np.asarray(altitudes, dtype=np.float64)
+    haut, bas = altitudes[graphe['origine']], altitudes[graphe['extremite']]
+    return haut < bas
+
+def exutoires_par_composante(graphe, altitudes) :
+    '''Choisit un exutoire par composante connexe : le noeud d'altitude connue
+    la plus basse (aucun si aucune altitude n'est connue dans la composante)
+    Sortie : numéros des noeuds exutoires'''
+    altitudes = np.asarray(altitudes, dtype=np.float64)
+    _, numero = composantes(graphe)
+    connus    = np.flatnonzero(~np.isnan(altitudes))
+    ordre     = connus[np.lexsort((altitudes[connus], numero[connus]))]
+    _, premier = np.unique(numero[ordre], return_index=True)
+    return ordre[premier]
+
+def orienter(graphe, altitudes=None, exutoires=None) :
+    '''Détermine le sens d'écoulement de chaque canalisation. Vers les
+    exutoires : l'eau va du noeud le plus éloigné (en nombre de canalisations)
+    au plus proche d'un exutoire. Les altitudes connues aux deux bouts
+    l'emportent : l'eau va du plus haut au plus bas. Sans information, le sens
+    de numérisation est gardé (premier sommet = amont)
+    Sortie : masque des canalisations à retourner (dessinées à contre-sens)'''
+    origine, extremite = graphe['origine'], graphe['extremite']
+    inverser = np.zeros(len(origine), dtype=bool)
+
+    if exutoires is not None and len(exutoires) :
+        #Distance aux exutoires par un noeud virtuel relié à chacun d'eux
+        k        = len(graphe['noeuds'])
+        lignes   = np.concatenate([np.repeat(np.arange(k), degres(graphe)),
+                                   np.full(len(exutoires), k)])
+        colonnes = np.concatenate([graphe['voisins'], exutoires])
+        liens    = csr_matrix((np.ones(len(lignes)), (lignes, colonnes)),
+                              shape=(k + 1, k + 1))
+        distance = shortest_path(liens, directed=False, unweighted=True,
+                                 indices=k)[:k]
+        loin, pres = distance[origine], distance[extremite]
+        connus     = np.isfinite(loin) & np.isfinite(pres)
+        inverser[connus] = loin[connus] < pres[connus]
+
+    if altitudes is not None :
+        altitudes = np.asarray(altitudes, dtype=np.float64)
+        haut, bas = altitudes[origine], altitudes[extremite]
+        connus    = ~np.isnan(haut) & ~np.isnan(bas) & (haut != bas)
+        inverser[connus] = haut[connus] < bas[connus]
+
+    return inverser
+
+def amont_aval(graphe, inverser=None) :
+    '''Noeud amont et noeud aval de chaque canalisation
+    Entrées : graphe, inverser = sortie de orienter (None = sens de
+    numérisation, premier sommet = amont)
+    Sortie  : noeuds amont, noeuds aval'''
+    amont, aval = graphe['origine'].copy(), graphe['extremite'].copy()
+    if inverser is not None :
+        amont[inverser], aval[inverser] = aval[inverser], amont[inverser]
+    return amont, aval
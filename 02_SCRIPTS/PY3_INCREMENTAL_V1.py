@@ -0,0 +1,279 @@
+#! /urs/bin/env python3
+# coding: utf-8
+
+'''
+RELANCE INCREMENTALE : COMPARAISON AU PASSAGE PRECEDENT ET CACHE SUR DISQUE
+Date          : 17/10/2026
+Version       : 1
+Compatibilité : Qgis 3 (numpy et scipy fournis avec Qgis), utilisable hors Qgis
+But           : Garder d'un passage à l'autre les sommets d'origine et recalés
+                de chaque canalisation, les points topo et leurs candidats,
+                pour ne refaire l'accrochage et l'affectation que dans les
+                groupes où quelque chose a changé
+Utilisation   : Module importé par PY3_AEP_RECALAGE_CANA_V2.py (doit se trouver
+                dans le même dossier, avec PY3_MOTEUR_RECALAGE_V1.py)
+Entrées       : Magasin des sommets (voir PY3_MOTEUR_RECALAGE_V1.py), points
+                topo retenus, cache du passage précédent
+Sorties       : Magasin recalé, doublons, fichier cache .npz
+'''
+
+#_______________________________________________________________________________
+
+####                             PARTIE FONCTIONS                           ####
+
+#Imports de modules
+import hashlib
+import os
+import numpy as np
+from   scipy.sparse         import coo_matrix
+from   scipy.sparse.csgraph import connected_components
+from   scipy.spatial        import cKDTree
+
+import PY3_MOTEUR_RECALAGE_V1 as moteur
+
+
+def empreinte(*morceaux) :
+    '''Empreinte (hachage court) d'une suite de morceaux : octets ou textes'''
+    hachage = hashlib.blake2b(digest_size=16)
+    for morceau in morceaux :
+        if not isinstance(morceau, (bytes, bytearray, memoryview)) :
+            morceau = str(morceau).encode('utf-8')
+        hachage.update(bytes(morceau))
+        hachage.update(b'\x00')                         #Séparateur
+    return hachage.hexdigest()
+
+def charger_cache(chemin) :
+    '''Relit le cache .npz du passage précédent (None s'il n'existe pas)'''
+    if not chemin or not os.path.exists(chemin) :
+        return None
+    with np.load(chemin) as fichier :
+        return {nom : fichier[nom] for nom in fichier.files}
+
+def enregistrer_cache(chemin, cache) :
+    '''Écrit le cache (tableaux numpy) dans un fichier temporaire puis le met
+    en place, pour ne jamais laisser un cache à moitié écrit'''
+    temporaire = chemin + '.tmp'
+    with open(temporaire, 'wb') as fichier :            #Sans ajout de .npz
+        np.savez(fichier, **cache)
+    os.replace(temporaire, chemin)
+
+def composantes_voisinage(lignes_candidates, nb_lignes) :
+    '''Groupes indépendants du recalage : composantes connexes du graphe qui
+    relie chaque point topo aux canalisations de ses candidats. Ce qui se
+    passe dans un groupe ne dépend d'aucun autre, on peut donc recalculer un
+    groupe seul
+    Sortie : numéro de groupe de chaque point, de chaque canalisation'''
+    m, k    = lignes_candidates.shape
+    lignes  = lignes_candidates.ravel()
+    points  = np.repeat(np.arange(m), k)
+    valides = lignes >= 0
+    liens   = coo_matrix((np.ones(int(valides.sum())),
+                          (points[valides], m + lignes[valides])),
+                         shape=(m + nb_lignes, m + nb_lignes))
+    _, groupes = connected_components(liens, directed=False)
+    return groupes[:m], groupes[m:]
+
+def memes_valeurs(a, b) :
+    '''Égalité terme à terme de deux tableaux de réels, nan égal à nan'''
+    return (a == b) | (np.isnan(a) & np.isnan(b))
+
+def correspondance_lignes(magasin, ancien) :
+    '''Rapproche les canalisations du magasin de celles du passage précédent
+    (même id d'entité) et compare leurs sommets d'un bloc
+    Sortie : position de chaque ligne dans l'ancien magasin (-1 = nouvelle),
+    masque des lignes inchangées (mêmes sommets, mêmes coordonnées), rang
+    dans l'ancien magasin de chaque sommet des lignes inchangées (-1 sinon)'''
+    ids, bornes       = moteur.bornes_lignes(magasin)
+    anciens, a_bornes = moteur.bornes_lignes(ancien)
+    tailles  = np.diff(bornes)
+    position = np.full(len(ids), -1, dtype=np.int64)
+    if len(anciens) :
+        trouve   = np.minimum(np.searchsorted(anciens, ids), len(anciens) - 1)
+        position = np.where(anciens[trouve] == ids, trouve, -1)
+    meme_nb  = (position >= 0) & (np.diff(a_bornes)[position] == tailles) \
+               if len(anciens) else position >= 0
+
+    #Rang dans l'ancien magasin de chaque sommet des lignes de même taille
+    ligne    = np.repeat(np.arange(len(ids)), tailles)
+    ancien_rang = np.full(len(magasin), -1, dtype=np.int64)
+    rangs    = np.flatnonzero(meme_nb[ligne])
+    ancien_rang[rangs] = (a_bornes[position[ligne[rangs]]]
+                          + rangs - bornes[ligne[rangs]])
+    egaux    = np.ones(len(rangs), dtype=bool)
+    for colonne in ('x', 'y', 'z') :
+        egaux &= memes_valeurs(magasin[colonne][rangs],
+                               ancien[colonne][ancien_rang[rangs]])
+    differents = np.bincount(ligne[rangs][~egaux], minlength=len(ids))
+    inchangees = meme_nb & (differents == 0)
+    ancien_rang[~inchangees[ligne]] = -1
+    return position, inchangees, ancien_rang
+
+def correspondance_points(xyz, anciens) :
+    '''Rapproche les points topo de ceux du passage précédent par leurs
+    coordonnées (x, y, z), quelle que soit leur place dans le tableau : les
+    points identiques sont appariés un à un, dans l'ordre où ils viennent
+    Sortie : rang dans anciens de chaque point (-1 = point ajouté ou
+    modifié)'''
+    if len(anciens) == 0 :
+        return np.full(len(xyz), -1, dtype=np.int64)
+    tous   = np.concatenate([anciens, xyz]) + 0.0       #-0.0 devient 0.0
+    ordre  = np.lexsort(tous.T[::-1])                   #Par x, y puis z
+    tries  = tous[ordre]
+    nouveau_groupe = np.ones(len(tous), dtype=bool)
+    nouveau_groupe[1:] = ~memes_valeurs(tries[1:], tries[:-1]).all(axis=1)
+    groupe = np.empty(len(tous), dtype=np.int64)
+    groupe[ordre] = np.cumsum(nouveau_groupe) - 1
+
+    #Rang d'apparition de chaque point parmi ses identiques, dans son tableau
+    def cles(groupes) :
+        rangs   = np.argsort(groupes, kind='stable')
+        premier = np.searchsorted(groupes[rangs], groupes[rangs])
+        rang    = np.empty(len(groupes), dtype=np.int64)
+        rang[rangs] = np.arange(len(groupes)) - premier
+        return groupes * len(tous) + rang
+    cles_anciennes = cles(groupe[:len(anciens)])
+    cles_nouvelles = cles(groupe[len(anciens):])
+    tri    = np.argsort(cles_anciennes)
+    trouve = np.minimum(np.searchsorted(cles_anciennes[tri], cles_nouvelles),
+                        len(anciens) - 1)
+    return np.where(cles_anciennes[tri][trouve] == cles_nouvelles, 
+                    tri[trouve], -1)
+
+def recaler_incremental(magasin, xyz, cache=None, parametres='',
+                        distance_max=None, k=1, methode=None, index=None) :
+    '''Recalage qui reprend le résultat du passage précédent là où rien n'a
+    changé. Points topo et canalisations candidates forment des groupes
+    indépendants (voir composantes_voisinage) ; un groupe est recalculé s'il
+    contenait une canalisation modifiée ou supprimée ou un point topo modifié
+    ou supprimé (points rapprochés par leurs coordonnées, voir 
+    correspondance_points), si ses points ont changé d'ordre entre eux (les
+    départages de l'affectation suivent l'ordre des points), ou si une 
+    canalisation modifiée ou nouvelle passe plus près d'un de ses points que
+    le dernier candidat de ce point. Seuls les points des groupes
+    recalculés sont accrochés et affectés ; les canalisations des autres
+    groupes reprennent leurs sommets recalés du cache, et leurs points leur
+    statut de doublon. Le résultat est celui d'un passage complet
+    Entrées : magasin = sommets d'origine (voir PY3_MOTEUR_RECALAGE_V1.py),
+    modifié sur place ; xyz = tableau (m, 3) des points topo retenus ; cache
+    = sortie de charger_cache (None = tout recalculer) ; parametres =
+    empreinte des paramètres (cache ignoré s'ils ont changé) ; distance_max,
+    k, methode = voir accrocher_points et affecter_points ; index = index
+    KD-tree du magasin (construit au besoin)
+    Sortie  : rangs des points en doublon, masque des lignes recalculées,
+    nouveau cache (voir enregistrer_cache), nombre de points recalculés'''
+    xyz       = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+    m         = len(xyz)
+    origine   = np.array(magasin)                       #Pour le cache suivant
+    ids, bornes = moteur.bornes_lignes(magasin)
+    nb_lignes = len(ids)
+    ligne_sommet = np.append(np.repeat(np.arange(nb_lignes), np.diff(bornes)),
+                             -1)                        #-1 reste -1
+    if cache is not None and (str(cache['parametres']) != parametres
+                              or cache['candidats'].shape[1] != k) :
+        cache = None                                    #Tout recalculer
+
+    #Groupes du passage précédent repris par les points et lignes inchangés
+    groupe_point = np.full(m, -1, dtype=np.int64)
+    groupe_ligne = np.full(nb_lignes, -1, dtype=np.int64)
+    candidats    = np.full((m, k), -1, dtype=np.int64)  #Ids des entités
+    rayon        = np.full(m, np.inf)
+    doublon      = np.zeros(m, dtype=bool)
+    ancien_rang  = np.full(len(magasin), -1, dtype=np.int64)
+    sales        = np.zeros(1, dtype=bool)              #Dernier : aucun groupe
+    if cache is not None :
+        nb_groupes = max(cache['groupe_point'].max(initial=-1),
+                         cache['groupe_ligne'].max(initial=-1)) + 1
+        sales      = np.zeros(nb_groupes + 1, dtype=bool)
+        position, inchangees, ancien_rang = correspondance_lignes(
+            magasin, cache['sommets'])
+        anciens_groupes = cache['groupe_ligne']
+        garde      = np.zeros(len(anciens_groupes), dtype=bool)
+        garde[position[inchangees]] = True
+        sales[anciens_groupes[~garde]] = True           #Modifiées, supprimées
+        groupe_ligne[inchangees] = anciens_groupes[position[inchangees]]
+
+        correspondant  = correspondance_points(xyz, cache['xyz'])
+        repris     = np.flatnonzero(correspondant >= 0)
+        anciens    = correspondant[repris]
+        anciens_points = cache['groupe_point']
+        apparies   = np.zeros(len(anciens_points), dtype=bool)
+        apparies[anciens] = True
+        sales[anciens_points[~apparies]] = True         #Modifiés, supprimés
+        groupe_point[repris] = anciens_points[anciens]
+        candidats[repris]    = cache['candidats'][anciens]
+        rayon[repris]        = cache['rayon'][anciens]
+        doublon[repris]      = cache['doublon'][anciens]
+        
+        #Groupes dont les points ont changé d'ordre entre eux
+        suite      = np.lexsort((anciens, groupe_point[repris])) #Par groupe,
+        groupes    = groupe_point[repris[suite]]        #dans l'ordre d'avant
+        rangs      = repris[suite]
+        inverses   = (groupes[1:] == groupes[:-1]) & (rangs[1:] < rangs[:-1])
+        sales[groupes[1:][inverses]] = True
+
+        #Points inchangés qu'une ligne modifiée ou nouvelle vient approcher
+        changes    = np.flatnonzero(~inchangees[ligne_sommet[:-1]])
+        if len(changes) and len(repris) :
+            proches, _ = cKDTree(np.column_stack(
+                [magasin['x'][changes], magasin['y'][changes]])).query(
+                    xyz[repris, :2], distance_upper_bound=np.inf)
+            sales[groupe_point[repris[proches <= rayon[repris]]]] = True
+        sales[-1] = False
+
+    #Points à refaire : nouveaux, modifiés ou dans un groupe sale, jusqu'à ce
+    #que leurs candidats n'atteignent plus de ligne d'un groupe propre
+    distances = np.full((m, k), np.inf)
+    indices   = np.full((m, k), -1, dtype=np.int64)
+    fait      = np.zeros(m, dtype=bool)
+    while True :
+        a_faire = ~fait & ((groupe_point < 0) | sales[groupe_point])
+        if not a_faire.any() :
+            break
+        if index is None :
+            index = moteur.indexer_sommets(np.column_stack(
+                [magasin['x'], magasin['y']]))
+        distances[a_faire], indices[a_faire] = moteur.accrocher_points(
+            index, xyz[a_faire, :2], k, distance_max)
+        fait   |= a_faire
+        atteintes = groupe_ligne[np.unique(ligne_sommet[indices[a_faire]])]
+        atteintes = atteintes[atteintes >= 0]
+        if len(atteintes) == 0 or sales[atteintes].all() :
+            break
+        sales[atteintes] = True
+
+    lignes_a_faire = (groupe_ligne < 0) | sales[groupe_ligne]
+    rangs     = np.flatnonzero(fait)
+
+    #Affectation des seuls points à refaire, puis reprise du cache
+    if methode is None :
+        choix = indices[rangs, 0]
+    else :
+        choix = moteur.affecter_points(distances[rangs], indices[rangs],
+                                       methode)
+    attribution, doublons = moteur.attribuer_sommets(choix, len(magasin),
+                                                     rangs)
+    moteur.substituer_sommets(magasin, attribution, xyz)
+    if cache is not None :
+        reprises = np.flatnonzero(~lignes_a_faire[ligne_sommet[:-1]])
+        magasin[reprises] = cache['resultat'][ancien_rang[reprises]]
+    doublon[rangs] = False
+    doublon[doublons] = True
+
+    #Cache du prochain passage
+    candidats[rangs] = np.append(ids, -1)[ligne_sommet[indices[rangs]]]
+    rayon[rangs]     = distances[rangs, -1]
+    absents          = rangs[indices[rangs, -1] < 0] #Moins de k candidats
+    rayon[absents]   = np.inf if distance_max is None else float(distance_max)
+    numeros          = np.searchsorted(ids, candidats)
+    numeros[candidats < 0] = -1
+    groupe_point, groupe_ligne = composantes_voisinage(numeros, nb_lignes)
+    nouveau = {'parametres'   : np.array(parametres),
+               'sommets'      : origine,
+               'resultat'     : np.array(magasin),
+               'xyz'          : xyz,
+               'candidats'    : candidats,
+               'rayon'        : rayon,
+               'doublon'      : doublon,
+               'groupe_point' : groupe_point,
+               'groupe_ligne' : groupe_ligne}
+    return np.flatnonzero(doublon), lignes_a_faire, nouveau, len(rangs)
@@ -0,0 +1,269 @@
+#! /urs/bin/env python3
+# coding: utf-8
+
+'''
+INDEX SPATIAL EN GRILLE POUR L'ACCROCHAGE AVEC TOLERANCE
+Date          : 17/10/2026
+Version       : 1
+Compatibilité : Qgis 3 (numpy et scipy fournis avec Qgis), utilisable hors Qgis
+But           : Retrouver pour chaque point (extrémité de canalisation...) le
+                point de référence (regard...) le plus proche dans une tolérance,
+                en temps constant en moyenne, par une grille régulière.
+                Garder sur disque les index construits (grille, KD-tree), sous
+                une clé tirée du contenu du fichier source et du système de
+                coordonnées, pour les relire (tableaux projetés en mémoire)
+                au lieu de les reconstruire d'un lancement à l'autre
+Utilisation   : Module importé par les scripts du dossier (doit se trouver dans
+                le même dossier qu'eux)
+Entrées       : Tableaux de coordonnées (n lignes, 2 colonnes X Y)
+Sorties       : Tableaux numpy. Cache : un sous-dossier par clé, avec un
+                fichier .npy par tableau, un fichier .pkl par autre objet et
+                meta.json (sa date sert à retirer les moins récemment utilisés)
+'''
+
+#_______________________________________________________________________________
+
+####                             PARTIE FONCTIONS                           ####
+
+#Imports de modules
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import numpy as np
+from   scipy.spatial import cKDTree
+
+VERSION_CACHE = 1                                       #Format des entrées
+ANNEXES_SHAPEFILE = ('.shp', '.shx', '.dbf', '.prj', '.cpg', '.qix')
+JOURNAUX_GPKG     = ('-wal', '-shm')                    #Journaux SQLite
+
+
+def cles_cellules(colonnes, lignes) :
+    '''Clé entière unique de chaque cellule de la grille (colonne, ligne)'''
+    return (colonnes.astype(np.int64) << 32) + (lignes.astype(np.int64)
+                                                & 0xFFFFFFFF)
+
+def construire_grille(xy, taille) :
+    '''Range les points de référence dans une grille de cellules carrées de
+    côté taille : points triés par cellule, avec le début de chaque cellule
+    dans ce tri (stockage compact en tableaux, sans dictionnaire)
+    Entrées : xy = tableau (n, 2) des points de référence, taille = côté des
+    cellules (au moins égal à la tolérance de recherche)
+    Sortie  : grille = dictionnaire de tableaux'''
+    xy      = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    taille  = float(taille)
+    cellule = np.floor(xy / taille).astype(np.int64)
+    cles    = cles_cellules(cellule[:, 0], cellule[:, 1])
+    ordre   = np.argsort(cles, kind='stable')
+    uniques, debuts = np.unique(cles[ordre], return_index=True)
+    return {'taille' : np.float64(taille),
+            'xy'     : xy,
+            'ordre'  : ordre,
+            'cles'   : uniques,
+            'debuts' : np.append(debuts, len(ordre)).astype(np.int64)}
+
+def plus_proche_grille(grille, xy, tolerance) :
+    '''Cherche pour chaque point le point de référence le plus proche à moins
+    de tolerance, en ne parcourant que les 9 cellules autour de lui
+    Entrées : grille = sortie de construire_grille (taille >= tolerance),
+    xy = tableau (m, 2) des points cherchés, tolerance = distance maximale
+    Sortie  : indices du point de référence trouvé (-1 = aucun), distances
+    (inf = aucun)'''
+    xy        = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    indices   = np.full(len(xy), -1, dtype=np.int64)
+    distances = np.full(len(xy), np.inf)
+    if len(xy) == 0 or len(grille['ordre']) == 0 :
+        return indices, distances
+    if tolerance > grille['taille'] :
+        raise ValueError("La tolérance dépasse la taille des cellules")
+
+    cellule = np.floor(xy / grille['taille']).astype(np.int64)
+    for dx in (-1, 0, 1) :
+        for dy in (-1, 0, 1) :
+            #Cellule voisine de chaque point cherché et son contenu
+            cles   = cles_cellules(cellule[:, 0] + dx, cellule[:, 1] + dy)
+            rang   = np.searchsorted(grille['cles'], cles)
+            rang   = np.minimum(rang, len(grille['cles']) - 1)
+            existe = grille['cles'][rang] == cles
+            debut  = grille['debuts'][rang]
+            nombre = np.where(existe, grille['debuts'][rang + 1] - debut, 0)
+            if not nombre.any() :
+                continue
+
+            #Couples (point cherché, candidat) mis à plat
+            points     = np.repeat(np.arange(len(xy)), nombre)
+            decalage   = np.arange(nombre.sum()) - np.repeat(
+                         np.cumsum(nombre) - nombre, nombre)
+            candidats  = grille['ordre'][np.repeat(debut, nombre) + decalage]
+            ecarts     = np.hypot(*(grille['xy'][candidats] - xy[points]).T)
+
+            #Meilleur candidat de chaque point, gardé s'il fait mieux
+            tri        = np.lexsort((ecarts, points))
+            _, premier = np.unique(points[tri], return_index=True)
+            meilleurs  = tri[premier]
+            points     = points[meilleurs]
+            mieux      = ecarts[meilleurs] < distances[points]
+            distances[points[mieux]] = ecarts[meilleurs][mieux]
+            indices[points[mieux]]   = candidats[meilleurs][mieux]
+
+    hors = distances > tolerance                        #Au-delà : pas retenu
+    indices[hors]   = -1
+    distances[hors] = np.inf
+    return indices, distances
+
+def distance_plus_proche(xy_reference, xy) :
+    '''Distance de chaque point au point de référence le plus proche, sans
+    limite (pour le rapport des points non raccordés)'''
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    if len(xy_reference) == 0 or len(xy) == 0 :
+        return np.full(len(xy), np.inf)
+    distances, _ = cKDTree(xy_reference).query(xy, k=1)
+    return distances
+
+def fichiers_source(chemin) :
+    '''Fichiers qui portent le contenu d'une source : le fichier lui-même,
+    les fichiers annexes d'un Shapefile (.shx, .dbf...) et les journaux -wal
+    et -shm d'un GeoPackage. Les autres fichiers de même nom (projet .qgz, 
+    export .xlsx...) sont ignorés'''
+    racine   = os.path.splitext(chemin)[0]
+    fichiers = {chemin}
+    if os.path.splitext(chemin)[1].lower() == '.shp' : 
+        for extension in ANNEXES_SHAPEFILE :            #Casse des deux sortes
+            fichiers.update([racine + extension, racine + extension.upper()])
+    fichiers.update(chemin + journal for journal in JOURNAUX_GPKG)
+    uniques  = {os.path.normcase(f) : f for f in sorted(fichiers) #Windows :
+                if os.path.isfile(f)}                   #casse indifférente
+    return sorted(uniques.values())
+
+def empreinte_fichier(chemin, dossier_cache=None, taille_bloc=2 ** 20) :
+    '''Empreinte du contenu d'une source (voir fichiers_source). Avec un
+    dossier de cache, l'empreinte d'un fichier est reprise tant que sa taille
+    et sa date de modification n'ont pas changé'''
+    memoire = {}
+    chemin_memoire = None
+    if dossier_cache :
+        chemin_memoire = os.path.join(dossier_cache, 'empreintes.json')
+        if os.path.exists(chemin_memoire) :
+            with open(chemin_memoire, encoding='utf-8') as fichier :
+                memoire = json.load(fichier)
+
+    hachage = hashlib.blake2b(digest_size=16)
+    for nom in fichiers_source(chemin) :
+        etat   = os.stat(nom)
+        connue = memoire.get(os.path.abspath(nom))
+        if connue and connue[:2] == [etat.st_size, etat.st_mtime_ns] :
+            hachage.update(connue[2].encode('ascii'))
+            continue
+        fichier_hache = hashlib.blake2b(digest_size=16)
+        with open(nom, 'rb') as fichier :
+            for bloc in iter(lambda : fichier.read(taille_bloc), b'') :
+                fichier_hache.update(bloc)
+        memoire[os.path.abspath(nom)] = [etat.st_size, etat.st_mtime_ns,
+                                         fichier_hache.hexdigest()]
+        hachage.update(fichier_hache.hexdigest().encode('ascii'))
+
+    if chemin_memoire :
+        os.makedirs(dossier_cache, exist_ok=True)
+        temporaire = chemin_memoire + '.tmp'
+        with open(temporaire, 'w', encoding='utf-8') as fichier :
+            json.dump(memoire, fichier)
+        os.replace(temporaire, chemin_memoire)
+    return hachage.hexdigest()
+
+def cle_cache(*morceaux) :
+    '''Clé d'une entrée du cache, tirée de ses morceaux (empreinte de la
+    source, système de coordonnées, paramètres de l'index)'''
+    hachage = hashlib.blake2b(str(VERSION_CACHE).encode('ascii'),
+                              digest_size=16)
+    for morceau in morceaux :
+        hachage.update(str(morceau).encode('utf-8'))
+        hachage.update(b'\x00')                         #Séparateur
+    return hachage.hexdigest()
+
+def cle_couche(couche, dossier_cache, *parametres) :
+    '''Clé du cache pour l'index d'une couche Qgis : contenu du fichier
+    source, source complète (nom de couche, filtre), système de coordonnées et
+    paramètres de l'index
+    Sortie : clé, ou None si la couche ne vient pas d'un fichier ou a des
+    modifications non enregistrées (pas de cache)'''
+    source = couche.source()
+    chemin = source.split('|')[0]
+    if not os.path.isfile(chemin) or couche.isModified() :
+        return None
+    return cle_cache(empreinte_fichier(chemin, dossier_cache), source,
+                     couche.subsetString(), couche.crs().toWkt(), *parametres)
+
+def lire_cache(dossier_cache, cle, mode='r') :
+    '''Relit une entrée du cache : les tableaux sont projetés en mémoire
+    (np.load avec mmap_mode=mode : 'r' en lecture seule, 'c' pour pouvoir les
+    modifier sans toucher au fichier), les autres objets sont dépicklés
+    Sortie : {nom : valeur}, ou None si l'entrée n'existe pas'''
+    if not dossier_cache or cle is None :
+        return None
+    dossier = os.path.join(dossier_cache, cle)
+    meta    = os.path.join(dossier, 'meta.json')
+    if not os.path.exists(meta) :
+        return None
+    with open(meta, encoding='utf-8') as fichier :
+        noms = json.load(fichier)
+    contenu = {}
+    for nom in noms['tableaux'] :
+        contenu[nom] = np.load(os.path.join(dossier, nom + '.npy'),
+                               mmap_mode=mode)
+    for nom in noms['objets'] :
+        with open(os.path.join(dossier, nom + '.pkl'), 'rb') as fichier :
+            contenu[nom] = pickle.load(fichier)
+    os.utime(meta)                                      #Dernier usage
+    return contenu
+
+def ecrire_cache(dossier_cache, cle, contenu, taille_max=None) :
+    '''Écrit une entrée du cache (dossier temporaire mis en place d'un
+    coup : jamais d'entrée à moitié écrite), puis retire les entrées les moins
+    récemment utilisées au-delà de taille_max (Mo, None = sans limite)
+    Entrées : contenu = {nom : valeur}, tableaux numpy (au moins une
+    dimension) en .npy, le reste picklé'''
+    if not dossier_cache or cle is None :
+        return
+    dossier    = os.path.join(dossier_cache, cle)
+    temporaire = dossier + '.tmp' + str(os.getpid())
+    os.makedirs(temporaire, exist_ok=True)
+    noms = {'tableaux' : [], 'objets' : []}
+    for nom, valeur in contenu.items() :
+        if isinstance(valeur, np.ndarray) and valeur.ndim > 0 \
+           and valeur.dtype != object :
+            np.save(os.path.join(temporaire, nom + '.npy'), valeur)
+            noms['tableaux'].append(nom)
+        else :
+            with open(os.path.join(temporaire, nom + '.pkl'), 'wb') as fichier :
+                pickle.dump(valeur, fichier, protocol=pickle.HIGHEST_PROTOCOL)
+            noms['objets'].append(nom)
+    with open(os.path.join(temporaire, 'meta.json'), 'w',
+              encoding='utf-8') as fichier :
+        json.dump(noms, fichier)
+
+    shutil.rmtree(dossier, ignore_errors=True)          #Entrée remplacée
+    try :
+        os.replace(temporaire, dossier)
+    except OSError :                                    #Écrite entre-temps
+        shutil.rmtree(temporaire, ignore_errors=True)
+    purger_cache(dossier_cache, taille_max)
+
+def purger_cache(dossier_cache, taille_max) :
+    '''Retire les entrées les moins récemment utilisées jusqu'à ce que le
+    cache tienne dans taille_max (Mo)'''
+    if taille_max is None or not os.path.isdir(dossier_cache) :
+        return
+    entrees = []
+    for nom in os.listdir(dossier_cache) :
+        meta = os.path.join(dossier_cache, nom, 'meta.json')
+        if os.path.exists(meta) :
+            taille = sum(f.stat().st_size for f
+                         in os.scandir(os.path.join(dossier_cache, nom)))
+            entrees.append((os.stat(meta).st_mtime, taille, nom))
+    total = sum(taille for _, taille, _ in entrees)
+    for _, taille, nom in sorted(entrees) :             #Plus anciennes d'abord
+        if total <= taille_max * 2 ** 20 :
+            break
+        shutil.rmtree(os.path.join(dossier_cache, nom), ignore_errors=True)
+        total -= taille
@@ -0,0 +1,131 @@
+#! /urs/bin/env python3
+# coding: utf-8
+
+'''
+INSTRUMENTATION : DUREE, EFFECTIFS ET MEMOIRE DE CHAQUE ETAPE
+Date          : 17/10/2026
+Version       : 1
+Compatibilité : Qgis 3, utilisable hors Qgis
+But           : Mesurer chaque étape d'un traitement (durée, entités en entrée
+                et en sortie, pic mémoire) et garder les comptages de contrôle
+                relevés pendant le traitement, sans repasser sur les couches
+                après coup, puis écrire un rapport lisible par un programme
+Utilisation   : Module importé par les scripts du dossier (doit se trouver dans
+                le même dossier qu'eux) :
+                suivi = nouveau_suivi('recalage')
+                with etape(suivi, 'lire_sommets', entrees) as mesure :
+                    ...
+                    mesure['sorties'] = ...
+                compter(suivi, 'canalisations_source', n)
+                enregistrer_rapport(terminer(suivi), 'RAPPORT.json')
+                Avec suivi = None, etape et compter ne mesurent rien
+Entrées       : Nom du traitement, des étapes et des comptages
+Sorties       : rapport = dictionnaire (traitement, debut, duree_totale_s,
+                rss_max_mo, etapes, compteurs), fichier .json ou .csv
+'''
+
+#_______________________________________________________________________________
+
+####                             PARTIE FONCTIONS                           ####
+
+#Imports de modules
+import contextlib
+import csv
+import json
+import time
+import tracemalloc
+try :
+    import resource                                     #Absent sous Windows
+except ImportError :
+    resource = None
+
+
+def nouveau_suivi(traitement, memoire=False) :
+    '''Commence le suivi d'un traitement
+    Entrées : traitement = nom du traitement, memoire = True pour mesurer le
+    pic mémoire de chaque étape (allocations Python et numpy suivies par
+    tracemalloc, qui ralentit le code Python : à réserver aux diagnostics)
+    Sortie  : suivi (dictionnaire) à passer aux étapes'''
+    demarre = memoire and not tracemalloc.is_tracing()
+    if demarre :
+        tracemalloc.start()
+    return {'traitement' : traitement,
+            'debut'      : time.strftime('%Y-%m-%d %H:%M:%S'),
+            'chrono'     : time.perf_counter(),
+            'memoire'    : bool(memoire),
+            'demarre'    : demarre,
+            'etapes'     : [],
+            'compteurs'  : {}}
+
+@contextlib.contextmanager
+def etape(suivi, nom, entrees=None) :
+    '''Mesure le bloc with : durée et, si demandé, pic mémoire. Le bloc
+    renseigne mesure['sorties'] (et mesure['entrees'] s'il ne le connaît
+    qu'en cours de route). Les étapes ne s'emboîtent pas : le pic mémoire
+    est remis à zéro au début de chacune'''
+    mesure = {'etape'   : nom,
+              'entrees' : entrees,
+              'sorties' : None,
+              'duree_s' : None,
+              'pic_mo'  : None}
+    if suivi is None :                                  #Pas de suivi
+        yield mesure
+        return
+    base = 0
+    if suivi['memoire'] :
+        base = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, 'reset_peak') :         #Python 3.9 et plus
+            tracemalloc.reset_peak()
+    debut = time.perf_counter()
+    try :
+        yield mesure
+    finally :
+        mesure['duree_s'] = round(time.perf_counter() - debut, 6)
+        if suivi['memoire'] :
+            pic = tracemalloc.get_traced_memory()[1] - base
+            mesure['pic_mo'] = round(max(pic, 0) / 2 ** 20, 2)
+        suivi['etapes'].append(mesure)
+
+def compter(suivi, nom, valeur) :
+    '''Garde un comptage de contrôle relevé pendant le traitement'''
+    if suivi is not None :
+        suivi['compteurs'][nom] = int(valeur)
+
+def terminer(suivi) :
+    '''Clôt le suivi
+    Sortie : rapport (dictionnaire prêt pour json)'''
+    if suivi['demarre'] :
+        tracemalloc.stop()
+    rss_max = None
+    if resource is not None :                           #Pic du processus
+        rss_max = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                        / 2 ** 10, 1)                   #Ko sous Linux
+    return {'traitement'     : suivi['traitement'],
+            'debut'          : suivi['debut'],
+            'duree_totale_s' : round(time.perf_counter() - suivi['chrono'], 6),
+            'rss_max_mo'     : rss_max,
+            'etapes'         : suivi['etapes'],
+            'compteurs'      : suivi['compteurs']}
+
+def enregistrer_rapport(rapport, chemin) :
+    '''Écrit le rapport en .json, ou en .csv (séparateur ;) : une ligne par
+    étape, puis une ligne par comptage (etape = compteur.nom, valeur dans
+    sorties)'''
+    if chemin.lower().endswith('.json') :
+        with open(chemin, 'w', encoding='utf-8') as fichier :
+            json.dump(rapport, fichier, indent=1)
+        return
+    colonnes = ['traitement', 'etape', 'entrees', 'sorties', 'duree_s',
+                'pic_mo']
+    with open(chemin, 'w', newline='', encoding='utf-8') as fichier :
+        ecrivain = csv.DictWriter(fichier, fieldnames=colonnes, delimiter=';')
+        ecrivain.writeheader()
+        for mesure in rapport['etapes'] :
+            ecrivain.writerow(dict(mesure, traitement=rapport['traitement']))
+        ecrivain.writerow({'traitement' : rapport['traitement'],
+                           'etape'      : 'total',
+                           'duree_s'    : rapport['duree_totale_s']})
+        for nom, valeur in rapport['compteurs'].items() :
+            ecrivain.writerow({'traitement' : rapport['traitement'],
+                               'etape'      : 'compteur.' + nom,
+                               'sorties'    : valeur})
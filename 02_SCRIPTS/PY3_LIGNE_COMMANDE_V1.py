@@ -0,0 +1,289 @@
+#! /urs/bin/env python3
+# coding: utf-8
+
+'''
+LIGNE DE COMMANDE : RECALAGE ET AMONT/AVAL SANS INTERFACE QGIS
+Date          : 17/10/2026
+Version       : 1
+Compatibilité : Qgis 3 (bibliothèques Python de Qgis, sans lancer l'interface)
+But           : Lancer PY3_AEP_RECALAGE_CANA_V2.py ou
+                PY3_CREATION_POINT_AMONT_AVAL_V4.py sur des fichiers
+                (GeoPackage, Shapefile, CSV LEICA) et écrire le résultat dans
+                un GeoPackage, pour traiter des communes à la chaîne
+Utilisation   : Dans un terminal où Python connaît Qgis (OSGeo4W Shell sous
+                Windows, par exemple) :
+                python PY3_LIGNE_COMMANDE_V1.py recalage --canalisations
+                    AEP_CANA.gpkg --topo export_leica.csv --id-cana OBJECTID
+                    --sortie RESULTAT.gpkg
+                python PY3_LIGNE_COMMANDE_V1.py amont-aval --canalisations
+                    CANALISATIONS.shp --regards REGARDS.shp --champs NUM_REG
+                    Z_RELEVE --id-cana num_tron --sortie RESULTAT.gpkg
+                python PY3_LIGNE_COMMANDE_V1.py recalage --help (toutes les
+                options)
+Entrées       : Chemins des fichiers et paramètres des scripts (par défaut, les
+                valeurs de leur partie DONNEES D'ENTREE)
+Sorties       : Un GeoPackage avec une couche par résultat du script, et avec
+                --rapport le rapport des étapes (.json ou .csv, voir
+                PY3_INSTRUMENTATION_V1.py)
+'''
+
+#_______________________________________________________________________________
+
+####                             PARTIE FONCTIONS                           ####
+
+#Imports de modules (Qgis et les scripts ne sont chargés qu'une fois les
+#arguments lus : --help et les erreurs de saisie répondent tout de suite)
+import argparse
+import os
+import sys
+
+DOSSIER_SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+
+
+def lire_arguments(arguments=None) :
+    '''Lit les arguments de la ligne de commande'''
+    analyseur = argparse.ArgumentParser(
+        description="Recalage des canalisations et amont/aval sans interface")
+    analyseur.add_argument('--prefixe-qgis', default=os.environ.get(
+                           'QGIS_PREFIX_PATH'),
+                           help="dossier d'installation de Qgis (par défaut "
+                                "la variable QGIS_PREFIX_PATH)")
+    commandes = analyseur.add_subparsers(dest='commande', required=True)
+
+    #Recalage des canalisations sur les points topographiques
+    recalage = commandes.add_parser('recalage',
+                                    help="PY3_AEP_RECALAGE_CANA_V2.py")
+    recalage.add_argument('--canalisations', required=True,
+                          help="couche de canalisations (fichier, ou "
+                               "fichier|layername=couche)")
+    recalage.add_argument('--topo', required=True,
+                          help="export CSV LEICA ou couche de points topo")
+    recalage.add_argument('--id-cana', help="identifiant unique des "
+                                            "canalisations")
+    recalage.add_argument('--filtre', help="formule de choix des points topo")
+    recalage.add_argument('--distance-max', type=float)
+    recalage.add_argument('--k-voisins', type=int)
+    recalage.add_argument('--methode', choices=['glouton', 'hongrois',
+                                                'aucune'])
+    recalage.add_argument('--processus', type=int)
+    recalage.add_argument('--halo', type=float)
+    recalage.add_argument('--segments', action='store_true',
+                          help="projection des points sur les segments")
+    recalage.add_argument('--tolerance-sommet', type=float,
+                          help="distance sous laquelle un point projeté "
+                               "remplace le sommet voisin")
+    recalage.add_argument('--cache', help="fichier cache du mode incrémental")
+    recalage.add_argument('--seuil-deplacement', type=float,
+                          help="déplacement d'un sommet au-delà duquel la "
+                               "canalisation est signalée")
+    recalage.add_argument('--seuil-longueur', type=float,
+                          help="changement de longueur (part, 0.1 = 10 %%) "
+                               "au-delà duquel la canalisation est signalée")
+    recalage.add_argument('--historique', action='store_true',
+                          help="enchaînement historique des traitements")
+    recalage.add_argument('--paralleles', action='store_true',
+                          help="branches indépendantes de l'enchaînement "
+                               "historique en même temps")
+    recalage.add_argument('--sequentiel', action='store_true',
+                          help="branches indépendantes de l'enchaînement "
+                               "historique l'une après l'autre")
+    recalage.add_argument('--sortie', required=True, help="GeoPackage créé")
+    recalage.add_argument('--rapport', help="rapport des étapes (.json, .csv)")
+    recalage.add_argument('--mesure-memoire', action='store_true',
+                          help="pic mémoire des étapes (plus lent)")
+    recalage.add_argument('--dossier-index',
+                          help="dossier où garder les sommets indexés et la "
+                               "topo d'un lancement à l'autre")
+    recalage.add_argument('--taille-index', type=float,
+                          help="taille maximale du dossier d'index (Mo)")
+
+    #Amont/aval des canalisations
+    amont_aval = commandes.add_parser('amont-aval',
+                                      help="PY3_CREATION_POINT_AMONT_AVAL_V4.py")
+    amont_aval.add_argument('--canalisations', required=True)
+    amont_aval.add_argument('--regards', required=True)
+    amont_aval.add_argument('--champs', nargs='+',
+                            help="champs des regards à joindre")
+    amont_aval.add_argument('--id-cana', help="identifiant unique des "
+                                              "canalisations")
+    amont_aval.add_argument('--tolerance', type=float)
+    amont_aval.add_argument('--champ-altitude')
+    amont_aval.add_argument('--historique', action='store_true',
+                            help="enchaînement historique des traitements")
+    amont_aval.add_argument('--paralleles', action='store_true',
+                            help="amont et aval de l'enchaînement historique "
+                                 "en même temps")
+    amont_aval.add_argument('--sequentiel', action='store_true',
+                            help="amont et aval de l'enchaînement historique "
+                                 "l'un après l'autre")
+    amont_aval.add_argument('--sortie', required=True, help="GeoPackage créé")
+    amont_aval.add_argument('--rapport', help="rapport des étapes (.json, .csv)")
+    amont_aval.add_argument('--mesure-memoire', action='store_true',
+                            help="pic mémoire des étapes (plus lent)")
+    amont_aval.add_argument('--dossier-index',
+                            help="dossier où garder l'index des regards d'un "
+                                 "lancement à l'autre")
+    amont_aval.add_argument('--taille-index', type=float,
+                            help="taille maximale du dossier d'index (Mo)")
+
+    return analyseur.parse_args(arguments)
+
+def valeur(argument, defaut) :
+    '''Valeur donnée en ligne de commande, sinon celle du script'''
+    return defaut if argument is None else argument
+
+def branches_paralleles(arguments, script) :
+    '''Branches de l'enchaînement historique en même temps : --paralleles ou
+    valeur du script, sauf --sequentiel'''
+    return ((arguments.paralleles or script.branches_paralleles)
+            and not arguments.sequentiel)
+
+def demarrer_qgis(prefixe, historique) :
+    '''Démarre Qgis sans interface. Le module processing est rendu importable
+    (les scripts l'importent) mais n'est initialisé que pour l'enchaînement
+    historique, seul à s'en servir'''
+    from qgis.core import QgsApplication
+    if prefixe :
+        QgsApplication.setPrefixPath(prefixe, True)
+    application = QgsApplication([], False)
+    application.initQgis()
+
+    sys.path.append(os.path.join(QgsApplication.pkgDataPath(), 'python',
+                                 'plugins'))
+    if historique :
+        from processing.core.Processing import Processing
+        from qgis.analysis             import QgsNativeAlgorithms
+        Processing.initialize()
+        QgsApplication.processingRegistry().addProvider(QgsNativeAlgorithms())
+    sys.path.append(DOSSIER_SCRIPTS)
+    return application
+
+def charger_couche(chemin) :
+    '''Ouvre une couche vecteur depuis un fichier'''
+    from qgis.core import QgsVectorLayer
+    nom    = os.path.splitext(os.path.basename(chemin.split('|')[0]))[0]
+    couche = QgsVectorLayer(chemin, nom, 'ogr')
+    if not couche.isValid() :
+        raise ValueError("Couche illisible : " + chemin)
+    return couche
+
+def enregistrer(couches, chemin) :
+    '''Écrit les couches dans un GeoPackage (une couche par résultat, nommée
+    comme dans Qgis)'''
+    from qgis.core import QgsProject, QgsVectorFileWriter
+    for rang, couche in enumerate(couches) :
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName   = 'GPKG'
+        options.layerName    = couche.name()
+        options.fileEncoding = 'UTF-8'
+        if rang > 0 :                                   #Fichier déjà créé
+            options.actionOnExistingFile = \
+                QgsVectorFileWriter.CreateOrOverwriteLayer
+        erreur, message, _, _ = QgsVectorFileWriter.writeAsVectorFormatV3(
+            couche, chemin, QgsProject.instance().transformContext(), options)
+        if erreur != QgsVectorFileWriter.NoError :
+            raise RuntimeError("Écriture impossible de " + couche.name()
+                               + " : " + message)
+        print(couche.name(), ':', couche.featureCount(), 'entités')
+
+def lancer_recalage(arguments, suivi=None) :
+    '''Recalage des canalisations (PY3_AEP_RECALAGE_CANA_V2.py)'''
+    import PY3_AEP_RECALAGE_CANA_V2 as script
+    cana    = charger_couche(arguments.canalisations)
+    topo    = arguments.topo
+    if not topo.lower().endswith('.csv') :              #Couche de points
+        topo = charger_couche(topo)
+    id_cana = valeur(arguments.id_cana,      script.id_cana)
+    filtre  = valeur(arguments.filtre,       script.filtre)
+    dmax    = valeur(arguments.distance_max, script.distance_max)
+    k       = valeur(arguments.k_voisins,    script.k_voisins)
+    methode = valeur(arguments.methode,      script.methode_affectation)
+    methode = None if methode == 'aucune' else methode
+    dossier = valeur(arguments.dossier_index, script.dossier_index)
+    taille  = valeur(arguments.taille_index,  script.taille_max_index)
+    seuils  = (valeur(arguments.seuil_deplacement, script.seuil_deplacement),
+               valeur(arguments.seuil_longueur,    script.seuil_longueur))
+
+    if arguments.historique :
+        if isinstance(topo, str) :                      #Lu par Qgis seulement
+            raise ValueError("L'enchaînement historique demande une couche "
+                             "de points topo, pas un CSV")
+        return script.main(cana, topo, id_cana, filtre, dmax, k, methode,
+                           suivi, branches_paralleles(arguments, script))
+    segments = arguments.segments or script.mode_segments
+    if segments and arguments.cache :
+        raise ValueError("Le mode segments ne passe pas par le cache "
+                         "incrémental")
+    if arguments.cache :
+        return script.pipeline_incremental(cana, topo, id_cana, filtre,
+                                           arguments.cache, dmax, k, methode,
+                                           suivi, dossier, taille, *seuils)
+    return script.pipeline_recalage(cana, topo, id_cana, filtre, dmax, k,
+                                    methode,
+                                    valeur(arguments.processus,
+                                           script.processus),
+                                    valeur(arguments.halo, script.halo),
+                                    suivi, dossier, taille, segments,
+                                    valeur(arguments.tolerance_sommet,
+                                           script.tolerance_sommet),
+                                    *seuils)
+
+def lancer_amont_aval(arguments, suivi=None) :
+    '''Amont/aval des canalisations (PY3_CREATION_POINT_AMONT_AVAL_V4.py)'''
+    import PY3_CREATION_POINT_AMONT_AVAL_V4 as script
+    cana      = charger_couche(arguments.canalisations)
+    rega      = charger_couche(arguments.regards)
+    champs    = list(valeur(arguments.champs,  script.champs))
+    id_cana   = valeur(arguments.id_cana,      script.ID_unique_cana)
+    tolerance = valeur(arguments.tolerance,    script.tolerance)
+
+    if arguments.historique :
+        return [script.canalisations_jointes(cana, rega, champs, id_cana,
+                                             tolerance, suivi,
+                                             branches_paralleles(arguments,
+                                                                 script))]
+    return script.canalisations_une_passe(cana, rega, champs, tolerance,
+                                          id_cana,
+                                          valeur(arguments.champ_altitude,
+                                                 script.champ_altitude),
+                                          suivi,
+                                          valeur(arguments.dossier_index,
+                                                 script.dossier_index),
+                                          valeur(arguments.taille_index,
+                                                 script.taille_max_index))
+
+def main(arguments=None) :
+    '''Lit les arguments, lance le script demandé et écrit le GeoPackage (et
+    le rapport des étapes)
+    Sortie : code de retour (0 = réussite)'''
+    arguments   = lire_arguments(arguments)
+    application = demarrer_qgis(arguments.prefixe_qgis, arguments.historique)
+    import PY3_INSTRUMENTATION_V1 as instrumentation
+    suivi = instrumentation.nouveau_suivi(arguments.commande,
+                                          arguments.mesure_memoire)
+    try :
+        if arguments.commande == 'recalage' :
+            couches = lancer_recalage(arguments, suivi)
+        else :
+            couches = lancer_amont_aval(arguments, suivi)
+        with instrumentation.etape(suivi, 'enregistrer') as mesure :
+            enregistrer(couches, arguments.sortie)
+            mesure['sorties'] = len(couches)
+        rapport = instrumentation.terminer(suivi)
+        if arguments.rapport :
+            instrumentation.enregistrer_rapport(rapport, arguments.rapport)
+        for nom, compte in rapport['compteurs'].items() :
+            print(nom, ':', compte)
+    except (ValueError, RuntimeError) as erreur :
+        print('ERREUR :', erreur, file=sys.stderr)
+        return 1
+    finally :
+        application.exitQgis()
+    return 0
+
+#_______________________________________________________________________________
+
+####                             SCRIPT PRINCIPAL                           ####
+
+if __name__ == '__main__' :
+    sys.exit(main())
@@ -0,0 +1,763 @@
+#! /urs/bin/env python3
+# coding: utf-8
+
+'''
+MOTEUR DE RECALAGE : CALCULS VECTORISES SUR LES SOMMETS ET LA TOPO
+Date          : 17/10/2026
+Version       : 1
+Compatibilité : Qgis 3 (numpy et scipy fournis avec Qgis), utilisable hors Qgis
+But           : Regrouper les calculs lourds du recalage sur des tableaux numpy
+                pour ne plus passer par les algorithmes de traitement entité par
+                entité
+Utilisation   : Module importé par PY3_AEP_RECALAGE_CANA_V2.py (doit se trouver
+                dans le même dossier)
+Entrées       : Tableaux de coordonnées (n lignes, 2 colonnes X Y), export
+                CSV LEICA des points topographiques
+Sorties       : Tableaux numpy
+'''
+
+#_______________________________________________________________________________
+
+####                             PARTIE FONCTIONS                           ####
+
+#Imports de modules
+import csv
+import functools
+import itertools
+import multiprocessing
+import os
+import re
+import sys
+import numpy as np
+from   concurrent.futures import ProcessPoolExecutor
+from   scipy.optimize     import linear_sum_assignment
+from   scipy.sparse       import coo_matrix
+from   scipy.sparse.csgraph import connected_components
+from   scipy.spatial      import cKDTree
+try :                                                   #Mode segments seulement
+    import shapely
+    from   shapely            import STRtree
+except ImportError :
+    shapely = None
+
+
+def indexer_sommets(xy) :
+    '''Construit une seule fois l'index KD-tree des sommets des canalisations
+    Entrées : xy = tableau (n, 2) des coordonnées des sommets
+    Sortie  : index KD-tree'''
+    return cKDTree(np.asarray(xy, dtype=np.float64)[:, :2])
+
+def accrocher_points(index, xy, k=1, distance_max=None) :
+    '''Cherche en une seule requête groupée les k sommets les plus proches de
+    chaque point topo
+    Entrées : index = index KD-tree des sommets, xy = tableau (m, 2) des points
+    topo, k = nombre de voisins, distance_max = distance d'accrochage maximale
+    (None = pas de limite)
+    Sortie  : distances (m, k), indices des sommets (m, k). Un voisin absent
+    (au-delà de distance_max) a une distance infinie et l'indice -1'''
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    if len(xy) == 0 or index.n == 0 :                   #Rien à accrocher
+        return (np.full((len(xy), k), np.inf),
+                np.full((len(xy), k), -1, dtype=np.int64))
+
+    borne = np.inf if distance_max is None else float(distance_max)
+    distances, indices = index.query(xy, k=k, distance_upper_bound=borne)
+    distances = np.asarray(distances, dtype=np.float64).reshape(len(xy), k)
+    indices   = np.asarray(indices,   dtype=np.int64).reshape(len(xy), k)
+    indices[indices >= index.n] = -1                    #Voisin non trouvé
+
+    return distances, indices
+
+def arcs_candidats(distances, indices) :
+    '''Met à plat les couples (point topo, sommet candidat) valides, triés par
+    distance croissante puis par ordre des points (départage stable)
+    Sortie  : points, sommets, distances des arcs (tableaux 1D)'''
+    m, k    = indices.shape
+    points  = np.repeat(np.arange(m), k)
+    sommets = indices.ravel()
+    dist    = distances.ravel()
+    valides = sommets >= 0
+    points, sommets, dist = points[valides], sommets[valides], dist[valides]
+    ordre   = np.lexsort((points, dist))
+    return points[ordre], sommets[ordre], dist[ordre]
+
+def affecter_glouton(distances, indices, part_min=0.1) :
+    '''Affectation gloutonne sur les distances triées : l'arc le plus court 
+    encore libre est retenu en premier. Calculée par tours vectorisés : à 
+    chaque tour, les couples qui sont mutuellement le meilleur choix l'un de 
+    l'autre sont retenus (même résultat que le parcours trié un par un). Dès 
+    qu'un tour retient moins de part_min des points restants (chaînes de 
+    candidats où chaque tour ne fixe qu'un couple), le reste est fini par un
+    seul parcours trié : le temps reste proportionnel au nombre d'arcs
+    Entrées : distances, indices = sorties de accrocher_points
+    Sortie  : sommet affecté à chaque point topo (-1 = non affecté)'''
+    affectation = np.full(len(indices), -1, dtype=np.int64)
+    points, sommets, _ = arcs_candidats(distances, indices)
+    while len(points) : 
+        #Premier arc de chaque point et de chaque sommet = son meilleur arc
+        restants, meilleur_point = np.unique(points, return_index=True)
+        _, meilleur_sommet = np.unique(sommets, return_index=True)
+        mutuels = np.intersect1d(meilleur_point, meilleur_sommet)
+        affectation[points[mutuels]] = sommets[mutuels]
+        
+        #Suppression des arcs touchant un point ou un sommet affecté
+        libres  = ~(np.isin(points,  points[mutuels]) 
+                    | np.isin(sommets, sommets[mutuels]))
+        points, sommets = points[libres], sommets[libres]
+        if len(mutuels) < part_min * len(restants) :   #Tours peu efficaces
+            break
+    
+    #Parcours trié des arcs restants (toujours dans l'ordre des distances)
+    places = set()
+    pris   = set()
+    for point, sommet in zip(points.tolist(), sommets.tolist()) : 
+        if point not in places and sommet not in pris : 
+            affectation[point] = sommet
+            places.add(point)
+            pris.add(sommet)
+    return affectation
+
+def affecter_hongrois(distances, indices, taille_max=2000) :
+    '''Affectation optimale (nombre de points placés maximal puis somme des 
+    distances minimale) résolue séparément dans chaque composante connexe du 
+    graphe creux points / sommets candidats. Les composantes de plus de 
+    taille_max points sont traitées par la méthode gloutonne
+    Entrées : distances, indices = sorties de accrocher_points
+    Sortie  : sommet affecté à chaque point topo (-1 = non affecté)'''
+    m           = len(indices)
+    affectation = np.full(m, -1, dtype=np.int64)
+    points, sommets, dist = arcs_candidats(distances, indices)
+    if len(points) == 0 : 
+        return affectation
+    
+    #Graphe creux biparti : noeuds 0..m-1 = points, m.. = sommets candidats
+    uniques, locaux = np.unique(sommets, return_inverse=True)
+    n      = m + len(uniques)
+    graphe = coo_matrix((np.ones(len(points)), (points, m + locaux)), 
+                        shape=(n, n))
+    _, etiquettes = connected_components(graphe, directed=False)
+    
+    #Composantes à un seul point : son meilleur candidat
+    composante = etiquettes[points]
+    effectifs  = np.bincount(etiquettes[:m], minlength=n)
+    seuls      = effectifs[composante] == 1
+    _, premier = np.unique(points[seuls], return_index=True)
+    affectation[points[seuls][premier]] = sommets[seuls][premier]
+    
+    #Composantes en conflit : résolution dans chacune
+    conflits   = np.flatnonzero(~seuls)
+    ordre      = conflits[np.argsort(composante[conflits], kind='stable')]
+    bornes     = np.flatnonzero(np.diff(composante[ordre])) + 1
+    for groupe in np.split(ordre, bornes) : 
+        if len(groupe) == 0 : 
+            continue
+        ligne, p_loc = np.unique(points[groupe],  return_inverse=True)
+        colon, s_loc = np.unique(sommets[groupe], return_inverse=True)
+        if len(ligne) > taille_max :                    #Trop gros : glouton
+            affectation[ligne] = affecter_glouton(distances[ligne], 
+                                                  indices[ligne])
+            continue
+        absent = dist[groupe].sum() + 1.0               #Coût d'un arc absent
+        cout   = np.full((len(ligne), len(colon)), absent)
+        cout[p_loc, s_loc] = dist[groupe]
+        lignes, colonnes = linear_sum_assignment(cout)
+        presents = cout[lignes, colonnes] < absent
+        affectation[ligne[lignes[presents]]] = colon[colonnes[presents]]
+    return affectation
+
+def affecter_points(distances, indices, methode='glouton') :
+    '''Résout les conflits quand plusieurs points topo visent le même sommet :
+    chaque point reçoit au plus un sommet libre parmi ses k candidats
+    Entrées : distances, indices = sorties de accrocher_points, methode = 
+    'glouton' (distances triées) ou 'hongrois' (optimal par composante)
+    Sortie  : sommet affecté à chaque point topo (-1 = non affecté)'''
+    if methode == 'glouton' : 
+        return affecter_glouton(distances, indices)
+    if methode == 'hongrois' : 
+        return affecter_hongrois(distances, indices)
+    raise ValueError("Méthode d'affectation inconnue : " + str(methode))
+
+#Magasin des sommets : une ligne par sommet, en colonnes (identifiant de la
+#canalisation, rang du sommet dans la canalisation, coordonnées ; z = nan si
+#la couche est en 2D)
+SOMMET = np.dtype([('id',           np.int64),
+                   ('vertex_index', np.int32),
+                   ('x',            np.float64),
+                   ('y',            np.float64),
+                   ('z',            np.float64)])
+
+def magasin_sommets(ids, vertex_index, xyz) :
+    '''Range des sommets dans un magasin (tableau structuré SOMMET)
+    Entrées : ids, vertex_index = identifiant de la ligne et rang de chaque
+    sommet, xyz = tableau (n, 3) des coordonnées
+    Sortie  : magasin, dans l'ordre reçu (voir grouper_sommets)'''
+    xyz     = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+    magasin = np.empty(len(xyz), dtype=SOMMET)
+    magasin['id']           = ids
+    magasin['vertex_index'] = vertex_index
+    magasin['x'], magasin['y'], magasin['z'] = xyz.T
+    return magasin
+
+def grouper_sommets(magasin) :
+    '''Tri groupé du magasin : par identifiant de ligne puis par vertex_index
+    (le tri n'est fait que si le magasin n'est pas déjà dans cet ordre)
+    Sortie : magasin trié'''
+    ordre = np.lexsort((magasin['vertex_index'], magasin['id']))
+    if np.any(ordre != np.arange(len(ordre))) :
+        magasin = magasin[ordre]
+    return magasin
+
+def bornes_lignes(magasin) :
+    '''Découpe un magasin trié (voir grouper_sommets) en lignes
+    Sortie : identifiants des lignes, bornes (les sommets de la ligne i sont
+    entre bornes[i] et bornes[i + 1])'''
+    ids, debuts = np.unique(magasin['id'], return_index=True)
+    return ids, np.append(debuts, len(magasin)).astype(np.int64)
+
+def attribuer_sommets(choix, nb_sommets, rangs=None) :
+    '''Attribue chaque sommet au premier point (dans l'ordre de rangs) qui l'a
+    choisi. Les points suivants sur le même sommet, et ceux sans sommet, sont
+    des doublons
+    Entrées : choix = sommet choisi par chaque point (-1 = aucun), nb_sommets
+    = taille du magasin, rangs = numéro de chaque point (0, 1, ... si None)
+    Sortie  : attribution = rang du point de chaque sommet (-1 = aucun), rangs
+    des points en doublon (dans l'ordre de rangs)'''
+    choix       = np.asarray(choix, dtype=np.int64)
+    rangs       = np.arange(len(choix)) if rangs is None \
+                  else np.asarray(rangs, dtype=np.int64)
+    attribution = np.full(nb_sommets, -1, dtype=np.int64)
+    valides     = np.flatnonzero(choix >= 0)
+    sommets, premiers = np.unique(choix[valides], return_index=True)
+    gagnants    = valides[premiers]
+    attribution[sommets] = rangs[gagnants]
+    doublons    = np.ones(len(choix), dtype=bool)
+    doublons[gagnants] = False
+    return attribution, rangs[doublons]
+
+def substituer_sommets(magasin, attribution, xyz) :
+    '''Remplace sur place les coordonnées des sommets attribués par celles de
+    leur point topo (z seulement si le sommet et le point en ont un)
+    Sortie : nombre de sommets remplacés'''
+    sommets = np.flatnonzero(attribution >= 0)
+    points  = np.asarray(xyz, dtype=np.float64)[attribution[sommets]]
+    magasin['x'][sommets] = points[:, 0]
+    magasin['y'][sommets] = points[:, 1]
+    avec_z  = ~np.isnan(magasin['z'][sommets]) & ~np.isnan(points[:, 2])
+    magasin['z'][sommets[avec_z]] = points[avec_z, 2]
+    return len(sommets)
+
+def segments_sommets(magasin) :
+    '''Segments des lignes d'un magasin trié (voir grouper_sommets)
+    Sortie : rang dans le magasin du premier sommet de chaque segment (le 
+    second est le suivant)'''
+    ids = magasin['id']
+    return np.flatnonzero(ids[1:] == ids[:-1]).astype(np.int64)
+
+def indexer_segments(magasin, segments) :
+    '''Construit en bloc l'index STRtree des segments (shapely 2)
+    Sortie : index, dans l'ordre de segments'''
+    if shapely is None or not hasattr(shapely, 'linestrings') :
+        raise ImportError("Le mode segments demande shapely 2 ou plus")
+    debut = np.column_stack([magasin['x'][segments], magasin['y'][segments]])
+    fin   = np.column_stack([magasin['x'][segments + 1], 
+                             magasin['y'][segments + 1]])
+    return STRtree(shapely.linestrings(np.stack([debut, fin], axis=1)))
+
+def projeter_segments(index, magasin, segments, xy, distance_max=None) :
+    '''Cherche en une requête groupée le segment le plus proche de chaque 
+    point et y projette le point
+    Entrées : index = sortie de indexer_segments, xy = tableau (n, 2) des 
+    points, distance_max = distance maximale (None = pas de limite)
+    Sortie  : segment (rang dans segments, -1 = aucun), position t sur le 
+    segment (0 = premier sommet, 1 = second), distance au segment et 
+    coordonnées (n, 2) du point projeté (nan sans segment)'''
+    xy       = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    segment  = np.full(len(xy), -1, dtype=np.int64)
+    t        = np.full(len(xy), np.nan)
+    distance = np.full(len(xy), np.inf)
+    projete  = np.full((len(xy), 2), np.nan)
+    if len(xy) == 0 or len(segments) == 0 :
+        return segment, t, distance, projete
+    points, trouves = index.query_nearest(shapely.points(xy), 
+                                          max_distance=distance_max, 
+                                          all_matches=False)
+    segment[points] = trouves
+    
+    #Projection vectorisée, bornée aux extrémités du segment
+    debuts = segments[trouves]
+    a      = np.column_stack([magasin['x'][debuts], magasin['y'][debuts]])
+    ab     = np.column_stack([magasin['x'][debuts + 1], 
+                              magasin['y'][debuts + 1]]) - a
+    carre  = np.einsum('ij,ij->i', ab, ab)
+    produit = np.einsum('ij,ij->i', xy[points] - a, ab)
+    t[points] = np.clip(np.divide(produit, carre, out=np.zeros_like(produit),
+                                  where=carre > 0), 0, 1)
+    projete[points]  = a + t[points, None] * ab
+    distance[points] = np.hypot(*(xy[points] - projete[points]).T)
+    return segment, t, distance, projete
+
+def inserer_sommets(magasin, rangs, t, xyz) :
+    '''Insère des sommets dans les segments d'un magasin trié
+    Entrées : rangs = rang dans le magasin du premier sommet du segment de 
+    chaque nouveau sommet, t = position sur le segment, xyz = coordonnées 
+    (z nan : interpolé si la ligne a un z)
+    Sortie  : nouveau magasin trié, vertex_index renumérotés, rang dans le 
+    nouveau magasin de chaque sommet de l'ancien'''
+    xyz   = np.array(xyz, dtype=np.float64).reshape(-1, 3)
+    z_a   = magasin['z'][rangs]
+    z_b   = magasin['z'][rangs + 1]
+    xyz[:, 2] = np.where(np.isnan(z_a), np.nan,        #Ligne sans z
+                         np.where(np.isnan(xyz[:, 2]), 
+                                  z_a + t * (z_b - z_a), xyz[:, 2]))
+    nouveaux = magasin_sommets(magasin['id'][rangs], 0, xyz)
+    ordre    = np.lexsort((t, rangs))                   #Ordre sur la ligne
+    origine  = np.arange(len(magasin)) + np.searchsorted(
+        np.sort(rangs + 1), np.arange(len(magasin)), side='right')
+    magasin  = np.insert(magasin, rangs[ordre] + 1, nouveaux[ordre])
+    
+    #Rang de chaque sommet dans sa ligne
+    ids      = magasin['id']
+    rang     = np.arange(len(magasin))
+    debut    = np.ones(len(magasin), dtype=bool)
+    debut[1:] = ids[1:] != ids[:-1]
+    magasin['vertex_index'] = rang - np.maximum.accumulate(
+        np.where(debut, rang, 0))
+    return magasin, origine
+
+def recaler_segments(magasin, xyz, distance_max=None, tolerance_sommet=0.5) :
+    '''Recalage sur les segments : chaque point topo est projeté sur le 
+    segment le plus proche (une requête groupée dans un STRtree). S'il tombe
+    à moins de tolerance_sommet d'un sommet existant, ce sommet prend ses 
+    coordonnées (le point le plus proche d'abord, les suivants sont des 
+    doublons) ; sinon un sommet est inséré au point projeté, avec le z du 
+    point topo. tolerance_sommet est de l'ordre de l'écart d'un relevé : un
+    point relevé sur un sommet le remplace au lieu d'en insérer un à côté
+    Entrées : magasin trié, xyz = tableau (n, 3) des points topo
+    Sortie  : nouveau magasin, nombre de sommets remplacés et insérés, rangs
+    des points en doublon ou sans segment, rang dans le nouveau magasin de 
+    chaque sommet reçu (voir controler_deplacements)'''
+    xyz      = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+    segments = segments_sommets(magasin)
+    index    = indexer_segments(magasin, segments)
+    segment, t, distance, projete = projeter_segments(
+        index, magasin, segments, xyz[:, :2], distance_max)
+    
+    #Points projetés sur un sommet existant (distance le long du segment)
+    valides  = segment >= 0
+    debuts   = np.where(valides, segments[np.maximum(segment, 0)], 0)
+    longueur = np.hypot(magasin['x'][debuts + 1] - magasin['x'][debuts], 
+                        magasin['y'][debuts + 1] - magasin['y'][debuts])
+    t_sur    = np.where(valides, t, 0.5)
+    premier  = valides & (t_sur * longueur <= tolerance_sommet)
+    second   = valides & ~premier & ((1 - t_sur) * longueur 
+                                     <= tolerance_sommet)
+    choix    = np.full(len(xyz), -1, dtype=np.int64)
+    choix[premier] = debuts[premier]
+    choix[second]  = debuts[second] + 1
+    ordre    = np.argsort(distance, kind='stable')      #Plus proches d'abord
+    attribution, rangs_doublons = attribuer_sommets(choix[ordre], 
+                                                    len(magasin), ordre)
+    remplaces = substituer_sommets(magasin, attribution, xyz)
+    
+    #Insertion des autres points
+    inseres  = valides & ~premier & ~second
+    nouveaux = np.column_stack([projete[inseres], xyz[inseres, 2]])
+    magasin, origine = inserer_sommets(magasin, debuts[inseres], t[inseres],
+                                       nouveaux)
+    rangs_doublons = np.sort(rangs_doublons[~inseres[rangs_doublons]])
+    return magasin, remplaces, int(inseres.sum()), rangs_doublons, origine
+
+def longueurs_lignes(magasin) :
+    '''Longueur (en plan) de chaque ligne d'un magasin trié
+    Sortie : identifiants des lignes, longueurs'''
+    ids, bornes = bornes_lignes(magasin)
+    ligne       = np.repeat(np.arange(len(ids)), np.diff(bornes))
+    pas         = np.hypot(np.diff(magasin['x']), np.diff(magasin['y']))
+    meme        = ligne[1:] == ligne[:-1]               #Pas entre deux lignes
+    return ids, np.bincount(ligne[1:][meme], weights=pas[meme], 
+                            minlength=len(ids))
+
+def controler_deplacements(avant, apres, origine=None) :
+    '''Bilan du recalage : déplacement de chaque sommet et, par ligne, 
+    sommets déplacés, déplacement maximal et moyen (des sommets déplacés), 
+    sommets insérés et longueurs avant et après
+    Entrées : avant, apres = magasins triés avant et après recalage (mêmes 
+    lignes), origine = rang dans apres de chaque sommet d'avant (None = 
+    mêmes rangs, sans insertion)
+    Sortie  : déplacement de chaque sommet d'avant, bilan = {nom : tableau, 
+    une case par ligne} (rang_max = rang dans apres du sommet le plus 
+    déplacé)'''
+    origine   = np.arange(len(avant)) if origine is None else origine
+    deplacement = np.hypot(apres['x'][origine] - avant['x'], 
+                           apres['y'][origine] - avant['y'])
+    ids, bornes = bornes_lignes(avant)
+    ligne     = np.repeat(np.arange(len(ids)), np.diff(bornes))
+    deplaces  = np.bincount(ligne, weights=deplacement > 0, 
+                            minlength=len(ids)).astype(np.int64)
+    somme     = np.bincount(ligne, weights=deplacement, minlength=len(ids))
+    ordre     = np.lexsort((-deplacement, ligne))       #Plus déplacé d'abord
+    _, longueur_avant = longueurs_lignes(avant)
+    _, longueur_apres = longueurs_lignes(apres)
+    _, bornes_apres   = bornes_lignes(apres)
+    bilan = {'id'                : ids,
+             'sommets_deplaces'  : deplaces,
+             'deplacement_max'   : deplacement[ordre[bornes[:-1]]],
+             'deplacement_moyen' : somme / np.maximum(deplaces, 1),
+             'rang_max'          : origine[ordre[bornes[:-1]]],
+             'sommets_inseres'   : np.diff(bornes_apres) - np.diff(bornes),
+             'longueur_avant'    : longueur_avant,
+             'longueur_apres'    : longueur_apres}
+    return deplacement, bilan
+
+def signaler_lignes(bilan, seuil_deplacement=None, seuil_longueur=None) :
+    '''Lignes hors normes : un sommet déplacé de plus de seuil_deplacement,
+    ou une longueur changée de plus de seuil_longueur (part de la longueur 
+    d'avant, 0.1 = 10 %). None = seuil non contrôlé
+    Sortie : masque des lignes signalées, motif de chacune (1 = 
+    déplacement, 2 = longueur, 3 = les deux)'''
+    motif = np.zeros(len(bilan['id']), dtype=np.int64)
+    if seuil_deplacement is not None :
+        motif += bilan['deplacement_max'] > seuil_deplacement
+    if seuil_longueur is not None :
+        ecart  = np.abs(bilan['longueur_apres'] - bilan['longueur_avant'])
+        motif += 2 * (ecart > seuil_longueur * bilan['longueur_avant'])
+    return motif > 0, motif
+
+def en_reels(valeurs) :
+    '''Convertit un tableau de textes en réels (virgule décimale acceptée, 
+    case vide = nan)'''
+    valeurs = np.char.strip(np.asarray(valeurs, dtype=str))
+    valeurs = np.char.replace(valeurs, ',', '.')
+    valeurs = np.where(np.char.str_len(valeurs) == 0, 'nan', valeurs)
+    return valeurs.astype(np.float64)
+
+def lire_topo_csv(chemin, predicat=None, champs=('X', 'Y', 'Z', 'Profondeur'),
+                  taille_bloc=100000, separateur=None, encodage='utf-8-sig') :
+    '''Lit l'export CSV LEICA par blocs de taille_bloc lignes et applique le
+    filtre pendant la lecture : seules les lignes retenues sont converties et 
+    gardées en mémoire
+    Entrées : chemin = fichier CSV, predicat = fonction qui reçoit le bloc sous
+    forme {nom de colonne : valeurs texte} et rend le masque des lignes à 
+    garder (None = tout garder), champs = colonnes à rendre, separateur = 
+    séparateur du CSV (None = détecté sur l'en-tête)
+    Sortie  : {champ : tableau} des lignes retenues. X, Y et Z sont des réels
+    (nan si vide ou absent), les autres champs restent du texte'''
+    morceaux = {nom : [] for nom in champs}
+    with open(chemin, newline='', encoding=encodage) as fichier :
+        premiere = fichier.readline()
+        if separateur is None :                         #Détection du séparateur
+            separateur = csv.Sniffer().sniff(premiere, ';,\t').delimiter
+        entete  = [nom.strip() for nom 
+                   in next(csv.reader([premiere], delimiter=separateur))]
+        lecteur = csv.reader(fichier, delimiter=separateur)
+        
+        while True :
+            lot  = list(itertools.islice(lecteur, taille_bloc))
+            if not lot :                                #Fin du fichier
+                break
+            #Lignes vides écartées, champs de fin absents complétés à vide
+            #(sinon la transposition couperait les colonnes de tout le bloc)
+            bloc = [ligne + [''] * (len(entete) - len(ligne)) 
+                    for ligne in lot if ligne]
+            if not bloc :
+                continue
+            colonnes = dict(zip(entete, zip(*bloc)))
+            garder   = np.ones(len(bloc), dtype=bool)
+            if predicat is not None :                   #Filtre appliqué au vol
+                garder = np.asarray(predicat(colonnes), dtype=bool)
+                if not garder.any() :
+                    continue
+            
+            for nom in champs :                         #Conversion des retenues
+                if nom in colonnes :
+                    valeurs = np.asarray(colonnes[nom], dtype=object)[garder]
+                else :
+                    valeurs = np.full(int(garder.sum()), '', dtype=object)
+                valeurs = valeurs.astype(str)
+                if nom in ('X', 'Y', 'Z') :
+                    valeurs = en_reels(valeurs)
+                morceaux[nom].append(valeurs)
+    
+    topo = {}
+    for nom in champs :
+        vide      = np.empty(0, dtype=np.float64 if nom in ('X', 'Y', 'Z') 
+                             else str)
+        topo[nom] = np.concatenate(morceaux[nom]) if morceaux[nom] else vide
+    return topo
+
+#Jetons du filtre : chaîne 'texte', nom de champ (éventuellement "entre 
+#guillemets") ou mot clé, symbole
+JETONS = re.compile(r"""\s*(?:(?P<chaine>'(?:[^']|'')*')"""
+                    r"""|(?P<nom>"(?:[^"]|"")*"|[^\W\d]\w*)"""
+                    r"""|(?P<symbole>[(),=]))""")
+
+def decouper_filtre(expression) :
+    '''Découpe le filtre en jetons (type, texte). Rend None si un morceau de 
+    l'expression n'est pas reconnu'''
+    jetons = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression) :
+        trouve = JETONS.match(expression, position)
+        if trouve is None :
+            return None
+        genre  = trouve.lastgroup
+        texte  = trouve.group(genre)
+        if genre == 'chaine' :
+            texte = texte[1:-1].replace("''", "'")
+        elif genre == 'nom' and texte.startswith('"') :
+            texte = texte[1:-1].replace('""', '"')
+            genre = 'champ'                             #Jamais un mot clé
+        jetons.append((genre, texte))
+        position = trouve.end()
+    return jetons
+
+def analyser_filtre(jetons) :
+    '''Analyse une suite de clauses reliées par OR sur un même champ : 
+    champ LIKE 'motif', champ ILIKE 'motif', champ = 'texte', 
+    champ IN ('texte', ...), éventuellement entre parenthèses
+    Sortie : (champ, liste des clauses (opérateur, valeurs)) ou None si 
+    l'expression sort de cette forme'''
+    position = [0]
+    
+    def lire() :
+        if position[0] >= len(jetons) :
+            raise ValueError
+        position[0] += 1
+        return jetons[position[0] - 1]
+    
+    def voir() :
+        return jetons[position[0]] if position[0] < len(jetons) else (None, '')
+    
+    def mot(jeton, attendu) :
+        return jeton[0] == 'nom' and jeton[1].upper() == attendu
+    
+    def expression() :
+        clauses = clause()
+        while mot(voir(), 'OR') :
+            lire()
+            clauses += clause()
+        return clauses
+    
+    def clause() :
+        if voir() == ('symbole', '(') :                 #Sous expression
+            lire()
+            clauses = expression()
+            if lire() != ('symbole', ')') :
+                raise ValueError
+            return clauses
+        genre, champ = lire()
+        if genre not in ('nom', 'champ') :
+            raise ValueError
+        operateur = lire()
+        if mot(operateur, 'LIKE') or mot(operateur, 'ILIKE') :
+            genre, motif = lire()
+            if genre != 'chaine' :
+                raise ValueError
+            return [(champ, operateur[1].upper(), [motif])]
+        if operateur == ('symbole', '=') :
+            genre, texte = lire()
+            if genre != 'chaine' :
+                raise ValueError
+            return [(champ, 'IN', [texte])]
+        if mot(operateur, 'IN') :
+            if lire() != ('symbole', '(') :
+                raise ValueError
+            valeurs = []
+            while True :
+                genre, texte = lire()
+                if genre != 'chaine' :
+                    raise ValueError
+                valeurs.append(texte)
+                suite = lire()
+                if suite == ('symbole', ')') :
+                    return [(champ, 'IN', valeurs)]
+                if suite != ('symbole', ',') :
+                    raise ValueError
+        raise ValueError
+    
+    try :
+        clauses = expression()
+    except ValueError :
+        return None
+    champs = {champ for champ, _, _ in clauses}
+    if position[0] != len(jetons) or len(champs) != 1 :  #Un seul champ
+        return None
+    return champs.pop(), [(operateur, valeurs) 
+                          for _, operateur, valeurs in clauses]
+
+def masque_like(valeurs, motif, casse=True) :
+    '''Masque des valeurs qui respectent le motif LIKE (% = n'importe quelle
+    suite de caractères, _ = un caractère). Les motifs simples (texte, texte%,
+    %texte, %texte%) passent par les fonctions vectorisées de numpy, les 
+    autres par une expression régulière compilée'''
+    if not casse :
+        valeurs, motif = np.char.upper(valeurs), motif.upper()
+    coeur = motif.strip('%')
+    if '%' not in coeur and '_' not in coeur :          #Motif simple
+        debut, fin = motif.startswith('%'), motif.endswith('%')
+        if debut and fin :
+            return np.char.find(valeurs, coeur) >= 0
+        if fin :
+            return np.char.startswith(valeurs, coeur)
+        if debut :
+            return np.char.endswith(valeurs, coeur)
+        return valeurs == coeur
+    regex = re.compile(''.join('.*' if c == '%' else '.' if c == '_' 
+                               else re.escape(c) for c in motif), re.DOTALL)
+    return np.fromiter((regex.fullmatch(v) is not None for v in valeurs), 
+                       dtype=bool, count=len(valeurs))
+
+@functools.lru_cache(maxsize=32)
+def compiler_filtre(expression) :
+    '''Compile une seule fois (cache par texte de l'expression) un filtre de 
+    la forme champ LIKE ... OR champ IN (...) OR ... en prédicat vectorisé sur
+    la colonne entière
+    Sortie : fonction qui reçoit {nom de colonne : valeurs} et rend le masque 
+    des lignes retenues (son attribut champ donne la colonne utilisée), ou 
+    None si l'expression n'a pas cette forme'''
+    jetons  = decouper_filtre(expression)
+    analyse = analyser_filtre(jetons) if jetons else None
+    if analyse is None :
+        return None
+    champ, clauses = analyse
+    
+    def predicat(colonnes) :
+        if champ not in colonnes :                      #Nom sans la casse
+            noms = {nom.upper() : nom for nom in colonnes}
+            if champ.upper() not in noms :
+                raise ValueError("Le champ " + champ + " du filtre est absent"
+                                 " des données (colonnes : " 
+                                 + ', '.join(colonnes) + ")")
+            valeurs = colonnes[noms[champ.upper()]]
+        else :
+            valeurs = colonnes[champ]
+        valeurs = np.asarray(valeurs, dtype=object)
+        vides   = np.array([v is None for v in valeurs], dtype=bool)
+        valeurs = valeurs.astype(str)
+        masque  = np.zeros(len(valeurs), dtype=bool)
+        for operateur, motifs in clauses :
+            if operateur == 'IN' :
+                masque |= np.isin(valeurs, motifs)
+            else :
+                masque |= masque_like(valeurs, motifs[0], operateur == 'LIKE')
+        return masque & ~vides                          #Champ vide : rejeté
+    
+    predicat.champ = champ
+    return predicat
+
+def groupes_conflits(indices) :
+    '''Groupes indépendants de points topo : composantes connexes du graphe 
+    qui relie chaque point à ses sommets candidats
+    Sortie : numéro de groupe de chaque point'''
+    m, k    = indices.shape
+    points  = np.repeat(np.arange(m), k)
+    sommets = indices.ravel()
+    valides = sommets >= 0
+    _, locaux = np.unique(sommets[valides], return_inverse=True)
+    n       = m + (locaux.max() + 1 if len(locaux) else 0)
+    liens   = coo_matrix((np.ones(len(locaux)), (points[valides], m + locaux)),
+                         shape=(n, n))
+    return connected_components(liens, directed=False)[1][:m]
+
+def decouper_tuiles(xy, nb_tuiles) :
+    '''Découpe l'emprise des points en une grille d'environ nb_tuiles tuiles
+    Sortie : numéro de tuile de chaque point'''
+    if len(xy) == 0 :
+        return np.zeros(0, dtype=np.int64)
+    cotes   = max(1, int(np.ceil(np.sqrt(nb_tuiles))))
+    mini    = xy.min(axis=0)
+    pas     = np.maximum((xy.max(axis=0) - mini) / cotes, 1e-9)
+    case    = np.minimum(((xy - mini) / pas).astype(np.int64), cotes - 1)
+    return case[:, 0] * cotes + case[:, 1]
+
+def accrocher_tuile(tache) :
+    '''Travail d'un processus : accrochage des points d'une tuile sur les 
+    sommets de la tuile élargie du halo
+    Entrées : tache = (xy des sommets, numéros globaux des sommets, xy des 
+    points, k, distance_max)
+    Sortie  : distances, indices globaux des sommets (voir accrocher_points)'''
+    xy_sommets, numeros, xy_points, k, distance_max = tache
+    distances, indices = accrocher_points(indexer_sommets(xy_sommets), 
+                                          xy_points, k, distance_max)
+    return distances, np.append(numeros, -1)[indices]   #-1 reste -1
+
+def affecter_lot(tache) :
+    '''Travail d'un processus : affectation d'un lot de groupes de points'''
+    distances, indices, methode = tache
+    return affecter_points(distances, indices, methode)
+
+def contexte_processus() :
+    '''Contexte multiprocessing qui relance bien l'interpréteur Python, y 
+    compris depuis Qgis (dont l'exécutable n'est pas python)'''
+    contexte = multiprocessing.get_context('spawn')
+    if not os.path.basename(sys.executable).lower().startswith('python') :
+        for nom in ('python.exe', 'python3', 'python') :
+            chemin = os.path.join(sys.exec_prefix, nom)
+            if not os.path.exists(chemin) :
+                chemin = os.path.join(sys.exec_prefix, 'bin', nom)
+            if os.path.exists(chemin) :
+                contexte.set_executable(chemin)
+                break
+    return contexte
+
+def recaler_parallele(xy_sommets, xy_points, k=1, distance_max=None, 
+                      methode=None, processus=None, halo=None) :
+    '''Accrochage et affectation répartis sur plusieurs processus : 
+    - accrochage par tuiles de points, chaque tuile voyant les sommets de son 
+      emprise élargie du halo (exact tant que distance_max <= halo) ;
+    - affectation par lots de groupes indépendants (points reliés par des 
+      sommets candidats communs), donc même résultat qu'en un seul processus
+    Entrées : xy_sommets (n, 2), xy_points (m, 2), k, distance_max, methode 
+    (voir accrocher_points et affecter_points), processus = nombre de 
+    processus (None = nombre de coeurs), halo = élargissement des tuiles 
+    (None = distance_max)
+    Sortie  : distances (m, k), indices (m, k), sommet choisi de chaque point 
+    (-1 = aucun ; sans methode, le plus proche)'''
+    xy_sommets = np.asarray(xy_sommets, dtype=np.float64).reshape(-1, 2)
+    xy_points  = np.asarray(xy_points,  dtype=np.float64).reshape(-1, 2)
+    halo       = distance_max if halo is None else float(halo)
+    if halo is None :
+        raise ValueError("Le calcul en parallèle demande une distance_max "
+                         "ou un halo")
+    borne      = halo if distance_max is None else min(distance_max, halo)
+    processus  = processus or os.cpu_count() or 1
+    m          = len(xy_points)
+    distances  = np.full((m, k), np.inf)
+    indices    = np.full((m, k), -1, dtype=np.int64)
+    
+    #Tuiles : points de la tuile et sommets de son emprise élargie
+    tuiles  = decouper_tuiles(xy_points, 4 * processus)
+    rangs   = [np.flatnonzero(tuiles == t) for t in np.unique(tuiles)]
+    taches  = []
+    for groupe in rangs :
+        mini    = xy_points[groupe].min(axis=0) - halo
+        maxi    = xy_points[groupe].max(axis=0) + halo
+        dedans  = np.flatnonzero(np.all((xy_sommets >= mini) 
+                                        & (xy_sommets <= maxi), axis=1))
+        taches.append((xy_sommets[dedans], dedans, xy_points[groupe], k, 
+                       borne))
+    
+    with ProcessPoolExecutor(processus, mp_context=contexte_processus()) \
+            as pool :
+        for groupe, (dist, ind) in zip(rangs, pool.map(accrocher_tuile, 
+                                                       taches)) :
+            distances[groupe], indices[groupe] = dist, ind
+        if methode is None :
+            return distances, indices, indices[:, 0].copy()
+        
+        #Lots de groupes indépendants, d'effectifs équilibrés
+        groupes = groupes_conflits(indices)
+        ordre   = np.argsort(groupes, kind='stable')
+        coupes  = np.flatnonzero(np.diff(groupes[ordre])) + 1
+        cibles  = np.searchsorted(coupes, np.linspace(0, m, 4 * processus + 1)
+                                  [1:-1])
+        lots    = [np.sort(lot) for lot in np.split(ordre, np.unique(
+                   np.append(coupes, m)[np.minimum(cibles, len(coupes))]))
+                   if len(lot)]
+        choix   = np.full(m, -1, dtype=np.int64)
+        for lot, resultat in zip(lots, pool.map(affecter_lot, 
+                                 [(distances[lot], indices[lot], methode) 
+                                  for lot in lots])) :
+            choix[lot] = resultat
+    return distances, indices, choix
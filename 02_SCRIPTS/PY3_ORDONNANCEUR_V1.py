@@ -0,0 +1,92 @@
+#! /urs/bin/env python3
+# coding: utf-8
+
+'''
+ORDONNANCEUR : ETAPES INDEPENDANTES LANCEES EN MEME TEMPS
+Date          : 17/10/2026
+Version       : 1
+Compatibilité : Qgis 3, utilisable hors Qgis
+But           : Lancer en même temps les branches indépendantes d'un
+                traitement (amont et aval, sommets et topo) puis réunir leurs
+                résultats : la première dans le fil courant, les autres dans
+                une réserve de fils. Les algorithmes de traitement de Qgis
+                rendent la main à Python pendant leur calcul. Le gain n'a pas
+                été mesuré : les scripts l'utilisent seulement sur demande
+                (branches_paralleles = False par défaut)
+Utilisation   : Module importé par les scripts du dossier (doit se trouver dans
+                le même dossier qu'eux) :
+                resultats = executer(
+                    {'amont' : (branche, cana, -1),
+                     'aval'  : (branche, copie_pour_branche(cana),  0)},
+                    avant_retour=rendre_au_fil_principal)
+                La première branche lit les couches d'origine, dans le fil
+                courant ; chacune des autres lit ses propres copies, faites
+                dans le fil principal avant le lancement. Chaque branche crée
+                ses propres couches (et processing.run son propre contexte,
+                dans le fil de la branche)
+Entrées       : Tâches = {nom : (fonction, arguments...)}
+Sorties       : Résultats = {nom : résultat de la fonction}
+'''
+
+#_______________________________________________________________________________
+
+####                             PARTIE FONCTIONS                           ####
+
+#Imports de modules
+from concurrent.futures import ThreadPoolExecutor
+
+
+def copie_pour_branche(couche, paralleles=True) :
+    '''Copie d'une couche d'entrée pour une branche, à faire dans le fil
+    principal avant de la lancer : une couche Qgis n'est pas faite pour être
+    lue par plusieurs fils à la fois. Une couche en mémoire, ou en cours de
+    modification, est recopiée avec ses entités (sa source ne les contient
+    pas, ou pas les modifications non enregistrées), les autres rouvrent
+    leur source. Sans paralleles, la couche est rendue telle quelle
+    Sortie : couche propre à la branche'''
+    if not paralleles :
+        return couche
+    if couche.providerType() == 'memory' or couche.isModified() :
+        from qgis.core import QgsFeatureRequest
+        return couche.materialize(QgsFeatureRequest())
+    return couche.clone()
+
+def rendre_au_fil_principal(resultat) :
+    '''Rend au fil principal les objets Qt (couches Qgis...) créés dans le fil
+    d'une tâche : un objet Qt reste attaché au fil qui l'a créé, et seul ce
+    fil peut le déplacer. Accepte un objet seul, un tuple ou une liste'''
+    from qgis.PyQt.QtCore import QCoreApplication
+    principal = QCoreApplication.instance().thread()
+    objets    = resultat if isinstance(resultat, (tuple, list)) else [resultat]
+    for objet in objets :
+        if hasattr(objet, 'moveToThread') :
+            objet.moveToThread(principal)
+    return resultat
+
+def executer(taches, paralleles=True, avant_retour=None) :
+    '''Exécute les tâches indépendantes, en même temps ou l'une après
+    l'autre. En même temps, la première tourne dans le fil courant (elle peut
+    lire les couches d'origine) et chacune des autres dans son fil (elles
+    doivent recevoir leurs copies : voir copie_pour_branche)
+    Entrées : taches = {nom : (fonction, arguments...)}, paralleles = False
+    pour les enchaîner dans le fil courant, avant_retour = fonction appliquée
+    au résultat dans le fil d'une tâche lancée à part (ex :
+    rendre_au_fil_principal)
+    Sortie  : {nom : résultat}, dans l'ordre des tâches. Si une tâche échoue,
+    son erreur est relancée une fois toutes les tâches terminées'''
+    if not paralleles or len(taches) < 2 :              #Fil courant
+        return {nom : tache[0](*tache[1:]) for nom, tache in taches.items()}
+
+    def lancer(fonction, *arguments) :
+        resultat = fonction(*arguments)
+        return avant_retour(resultat) if avant_retour else resultat
+
+    noms = list(taches)
+    with ThreadPoolExecutor(max_workers=len(taches) - 1) as reserve :
+        futurs    = {nom : reserve.submit(lancer, *taches[nom])
+                     for nom in noms[1:]}
+        premiere  = taches[noms[0]]                     #Dans le fil courant
+        resultats = {noms[0] : premiere[0](*premiere[1:])}
+        resultats.update({nom : futur.result() for nom, futur 
+                          in futurs.items()})
+    return resultats